@@ -0,0 +1,16 @@
+RECORDS = [10**i for i in range(3, 9)]
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--max-records",
+        type=int,
+        default=10**6,
+        help="Benchmark time series of up to this number of records",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "records" in metafunc.fixturenames:
+        max_records = metafunc.config.getoption("max_records")
+        metafunc.parametrize("records", [r for r in RECORDS if r <= max_records])
@@ -0,0 +1,48 @@
+"""Synthetic time series for the benchmarks."""
+
+import functools
+
+import numpy as np
+import pandas as pd
+from htimeseries import HTimeseries
+
+# Keyword arguments of make_timeseries() for each pattern
+PATTERNS = {
+    "regular": {},
+    "irregular": {"irregular": True},
+    "gaps": {"irregular": True, "gap": "30D"},
+    "nans": {"nan_fraction": 0.5},
+}
+
+
+@functools.lru_cache(maxsize=4)
+def make_timeseries(records, step, irregular=False, gap=None, nan_fraction=0.0):
+    """Return a HTimeseries with synthetic data.
+
+    If "irregular", the timestamps are moved by up to a third of the step, and a
+    tenth of the records are omitted. If "gap" is specified, the second half of the
+    time series starts that much later. A "nan_fraction" of the values, in runs of
+    random length, are NaN. The result is cached, so it must not be modified.
+    """
+    rng = np.random.default_rng(42)
+    step_ns = pd.Timedelta(step).value
+    timestamps = pd.Timestamp("2000-01-01").value + np.arange(records) * step_ns
+    if irregular:
+        jitter = rng.integers(-step_ns // 3, step_ns // 3, records)
+        timestamps += jitter // 10**9 * 10**9
+        timestamps = timestamps[rng.random(records) >= 0.1]
+    if gap:
+        half = len(timestamps) // 2
+        timestamps[half:] += pd.Timedelta(gap).value
+    values = rng.normal(20, 5, len(timestamps))
+    if nan_fraction:
+        run_starts = rng.random(len(timestamps)) < 0.01
+        run_is_nan = rng.random(len(timestamps) + 1) < nan_fraction
+        values[run_is_nan[np.cumsum(run_starts)]] = np.nan
+    ts = HTimeseries()
+    ts.time_step = step
+    ts.data = pd.DataFrame(
+        {"value": values, "flags": np.full(len(timestamps), "", dtype=object)},
+        index=pd.DatetimeIndex(timestamps, name="date").tz_localize("UTC"),
+    )
+    return ts
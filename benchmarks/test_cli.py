@@ -0,0 +1,90 @@
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from click.testing import CliRunner
+from generators import make_timeseries
+from htimeseries import HTimeseries
+
+from haggregate import cli
+
+
+@pytest.fixture
+def configfile(tmp_path, records):
+    ts = make_timeseries(records, "10min", irregular=True)
+    with open(tmp_path / "source.hts", "w") as f:
+        ts.write(f, format=HTimeseries.FILE)
+    config = textwrap.dedent(
+        """\
+        [General]
+        base_dir = {}
+        target_step = 1H
+        min_count = 3
+        missing_flag = MISS
+
+        [mean]
+        source_file = source.hts
+        target_file = mean.hts
+        method = mean
+
+        [sum]
+        source_file = source.hts
+        target_file = sum.hts
+        method = sum
+        """
+    ).format(tmp_path)
+    configfile = tmp_path / "haggregate.conf"
+    configfile.write_text(config)
+    return str(configfile)
+
+
+def test_main(benchmark, configfile):
+    result = benchmark(CliRunner().invoke, cli.main, [configfile])
+    assert result.exit_code == 0
+
+
+@pytest.fixture
+def many_sources_configfile(tmp_path, records, pipeline):
+    ts = make_timeseries(records, "10min", irregular=True)
+    config = textwrap.dedent(
+        """\
+        [General]
+        base_dir = {}
+        target_step = 1H
+        min_count = 3
+        missing_flag = MISS
+        pipeline = {}
+        """
+    ).format(tmp_path, pipeline)
+    for i in range(4):
+        with open(tmp_path / "source{}.hts".format(i), "w") as f:
+            ts.write(f, format=HTimeseries.FILE)
+        config += textwrap.dedent(
+            """\
+
+            [sum{0}]
+            source_file = source{0}.hts
+            target_file = sum{0}.hts
+            method = sum
+            """
+        ).format(i)
+    configfile = tmp_path / "haggregate.conf"
+    configfile.write_text(config)
+    return str(configfile)
+
+
+@pytest.mark.parametrize("pipeline", [0, 2])
+def test_pipeline(benchmark, many_sources_configfile, pipeline):
+    result = benchmark(CliRunner().invoke, cli.main, [many_sources_configfile])
+    assert result.exit_code == 0
+
+
+@pytest.mark.parametrize("args", [["--help"], ["/nonexistent/haggregate.conf"]])
+def test_startup(benchmark, args):
+    """Time for the cli to start and exit when there is no work to do."""
+
+    def run():
+        return subprocess.run([sys.executable, "-m", "haggregate.cli"] + args)
+
+    benchmark(run)
@@ -0,0 +1,117 @@
+"""Benchmarks; run them with "pytest benchmarks", which requires pytest-benchmark.
+
+Use "--max-records" to specify the size of the largest time series (the default
+is 10**6), and "--benchmark-json" to save the results in machine-readable form.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from generators import make_timeseries
+from htimeseries import HTimeseries, TzinfoFromString
+
+from haggregate.haggregate import (
+    AggregatedTimeseries,
+    Aggregation,
+    _create_plan,
+    aggregate,
+    aggregate_arrays,
+    methods,
+)
+
+
+@pytest.mark.parametrize("leading_nans", [10**4, 10**5, 10**6])
+def test_remove_leading_and_trailing_nans(benchmark, leading_nans):
+    index = pd.date_range("1970-01-01", periods=leading_nans + 2000, freq="h", tz="UTC")
+    values = np.full(len(index), np.nan)
+    values[leading_nans:-1000] = 1.0
+    data = pd.DataFrame({"value": values, "flags": ""}, index=index)
+
+    def remove_leading_and_trailing_nans():
+        ts = AggregatedTimeseries()
+        ts.data = data
+        ts.remove_leading_and_trailing_nans()
+        return ts
+
+    result = benchmark(remove_leading_and_trailing_nans)
+    assert len(result.data) == 1000
+
+
+@pytest.mark.parametrize("target_step", ["1H", "1D"])
+def test_aggregate_arrays(benchmark, records, target_step):
+    ts = make_timeseries(records, "10min", gap="30D")
+    index_ns = ts.data.index.asi8
+    values = ts.data["value"].to_numpy(dtype=np.float64)
+
+    def aggregate():
+        return aggregate_arrays(index_ns, values, "10min", target_step, "sum")
+
+    index, values, counts, missing = benchmark(aggregate)
+    assert missing.any()
+
+
+@pytest.mark.parametrize("nan_fraction", [0.0, 0.5])
+@pytest.mark.parametrize("target_step", ["1H", "1D"])
+@pytest.mark.parametrize("method", [m for m in methods if m != "time_of_max"])
+def test_aggregation_execute(benchmark, records, method, target_step, nan_fraction):
+    ts = make_timeseries(records, "10min", nan_fraction=nan_fraction)
+
+    def execute():
+        aggregation = Aggregation(
+            source_timeseries=ts,
+            target_step=target_step,
+            method=method,
+            min_count=3,
+            missing_flag="MISS",
+            target_timestamp_offset=None,
+        )
+        aggregation.execute()
+        return aggregation.result
+
+    result = benchmark(execute)
+    assert len(result.data) > 0
+
+
+def test_extra_methods(benchmark, records):
+    ts = make_timeseries(records, "10min", nan_fraction=0.1)
+
+    def execute():
+        return aggregate(
+            ts, "1D", "mean", extra_methods=["std", "p90", "last", "time_of_max"]
+        )
+
+    result = benchmark(execute)
+    assert len(result.data.columns) == 6
+
+
+@pytest.mark.parametrize("cache_plans", [True, False])
+def test_aggregate_many_series(benchmark, cache_plans):
+    """Aggregate a network of time series with the same range (a year each)."""
+    ts = make_timeseries(52560, "10min", nan_fraction=0.1)
+    index_ns = ts.data.index.asi8
+    values = ts.data["value"].to_numpy(dtype=np.float64)
+
+    def aggregate_all():
+        for i in range(100):
+            if not cache_plans:
+                _create_plan.cache_clear()
+            aggregate_arrays(index_ns, values, "10min", "1H", "mean")
+
+    benchmark(aggregate_all)
+
+
+@pytest.mark.parametrize("convert_source", [True, False])
+def test_target_timezone(benchmark, records, convert_source):
+    """Daily sums in another time zone, converting the source or only the edges."""
+    ts = make_timeseries(records, "10min", nan_fraction=0.1)
+
+    def execute():
+        if not convert_source:
+            return aggregate(ts, "1D", "sum", target_timezone="+0200")
+        converted = HTimeseries()
+        converted.time_step = ts.time_step
+        converted.data = ts.data.tz_convert(TzinfoFromString("+0200"))
+        return aggregate(converted, "1D", "sum")
+
+    result = benchmark(execute)
+    assert result.data.index[0].hour == 0
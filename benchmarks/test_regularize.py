@@ -0,0 +1,15 @@
+import pytest
+from generators import PATTERNS, make_timeseries
+
+from haggregate import RegularizationMode, regularize
+
+
+@pytest.mark.parametrize(
+    "mode", [RegularizationMode.INTERVAL, RegularizationMode.INSTANTANEOUS]
+)
+@pytest.mark.parametrize("pattern", PATTERNS)
+@pytest.mark.parametrize("step", ["1min", "5min", "10min"])
+def test_regularize(benchmark, records, step, pattern, mode):
+    ts = make_timeseries(records, step, **PATTERNS[pattern])
+    result = benchmark(regularize, ts, mode=mode)
+    assert len(result.data) >= len(ts.data)
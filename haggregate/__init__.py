@@ -1,6 +1,59 @@
-from .haggregate import *  # NOQA
-from .regularize import *  # NOQA
+import importlib
+import sys
+import types
 
 __author__ = """Antonis Christofides"""
 __email__ = "antonis@antonischristofides.com"
 __version__ = "0.1.0.dev0"
+
+# The public names of these modules are available from the package, but, as the
+# modules import pandas, which is slow, they are imported only when first used.
+_lazy_names = {
+    "haggregate": (
+        "AggregateError",
+        "AggregatedTimeseries",
+        "Aggregation",
+        "CannotInferFrequency",
+        "RegularizationMode",
+        "SourceTimeseries",
+        "StreamingAggregation",
+        "aggregate",
+        "aggregate_arrays",
+        "aggregate_frame",
+        "aggregate_iter",
+        "methods",
+    ),
+    "regularize": (
+        "RegularizeError",
+        "regularize",
+        "regularize_arrays",
+        "regularize_frame",
+    ),
+}
+
+__all__ = [name for names in _lazy_names.values() for name in names]
+
+
+def __getattr__(name):
+    for module_name, names in _lazy_names.items():
+        if name in names:
+            module = importlib.import_module("." + module_name, __name__)
+            return getattr(module, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # When the haggregate.regularize module is imported, the import system sets
+        # it as the "regularize" attribute of the package, which must remain the
+        # function.
+        if name in __all__ and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
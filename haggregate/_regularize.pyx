@@ -0,0 +1,92 @@
+# cython: language_level=3, linetrace=True
+# distutils: define_macros=CYTHON_TRACE=1
+
+cimport cython
+cimport numpy as np
+from libc.math cimport NAN, isnan
+from libc.stdlib cimport llabs
+
+from .haggregate import RegularizationMode as RM
+
+cdef int INTERVAL = RM.INTERVAL.value
+
+
+def _perform_regularization(
+    const np.int64_t[:] result_index,
+    double[:] result_values,
+    np.int64_t[:] result_sources,
+    np.uint8_t[:] result_inserted,
+    const np.int64_t[:] ts_index,
+    const double[:] ts_values,
+    np.int64_t result_step,
+    int mode,
+):
+    """Fill in result_values, result_sources and result_inserted.
+
+    For each result timestamp, result_sources gets the index of the source record
+    used, or -1 if none; result_inserted is nonzero if the source record has a
+    different timestamp.
+    """
+    with nogil:
+        _regularize(
+            result_index,
+            result_values,
+            result_sources,
+            result_inserted,
+            ts_index,
+            ts_values,
+            result_step,
+            mode == INTERVAL,
+        )
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _regularize(
+    const np.int64_t[:] result_index,
+    double[:] result_values,
+    np.int64_t[:] result_sources,
+    np.uint8_t[:] result_inserted,
+    const np.int64_t[:] ts_index,
+    const double[:] ts_values,
+    np.int64_t result_step,
+    bint interval_mode,
+) nogil:
+    cdef Py_ssize_t i, j, nearest, count
+    cdef Py_ssize_t pos = 0
+    cdef Py_ssize_t n = ts_index.shape[0]
+    cdef np.int64_t t, start, end
+    cdef np.int64_t half_step = result_step // 2
+    cdef bint exact
+
+    for i in range(result_index.shape[0]):
+        t = result_index[i]
+        start = t - half_step
+        end = t + result_step - half_step
+
+        # The windows of consecutive result records are adjacent, so the source
+        # records before this window will never be needed again.
+        while pos < n and ts_index[pos] < start:
+            pos += 1
+
+        # Find the exact match, if it exists, otherwise the nearest record
+        exact = False
+        nearest = -1
+        count = 0
+        j = pos
+        while j < n and ts_index[j] < end:
+            if interval_mode or not isnan(ts_values[j]):
+                if ts_index[j] == t:
+                    exact = True
+                    nearest = j
+                    break
+                count += 1
+                if nearest < 0 or llabs(t - ts_index[j]) < llabs(t - ts_index[nearest]):
+                    nearest = j
+            j += 1
+
+        if not exact and (count < 1 or (count > 1 and interval_mode)):
+            nearest = -1
+        result_sources[i] = nearest
+        result_inserted[i] = nearest >= 0 and not exact
+        result_values[i] = ts_values[nearest] if nearest >= 0 else NAN
@@ -0,0 +1,131 @@
+"""Binary cache of parsed source files.
+
+The cache of a file such as "temperature.hts" is the directory
+"temperature.hts.cache". It contains the timestamps (int64 nanoseconds since the
+epoch), the values (float64) and the codes of the flags in .npy files, which are
+memory-mapped when read, and "meta.json", with the header of the file, the
+vocabulary of the flags, and the size and modification time of the file when it was
+cached. The cache is used only if the size and modification time of the file are
+unchanged.
+"""
+
+import datetime as dt
+import json
+import logging
+import os
+import tempfile
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from htimeseries import HTimeseries
+
+ARRAYS = ("index", "values", "flag_codes")
+
+
+def read(filename, start_date=None, default_tzinfo=dt.timezone.utc):
+    """Read a file in htimeseries file format, using and updating its cache.
+
+    "start_date" has the same meaning as in HTimeseries.
+    """
+    stat = os.stat(filename)
+    cache_dir = filename + ".cache"
+    meta = _read_meta(cache_dir)
+    if (
+        meta is None
+        or meta["size"] != stat.st_size
+        or meta["mtime"] != stat.st_mtime_ns
+    ):
+        meta = _create(filename, cache_dir, stat, default_tzinfo)
+    arrays = {
+        name: np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r")
+        for name in ARRAYS
+    }
+    return _get_timeseries(meta, arrays, start_date, default_tzinfo)
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _create(filename, cache_dir, stat, default_tzinfo):
+    logging.getLogger("haggregate").debug("Caching " + filename)
+    with open(filename, newline="\n") as f:
+        header = _read_header(f)
+        f.seek(0)
+        ts = HTimeseries(f, format=HTimeseries.FILE, default_tzinfo=default_tzinfo)
+    flag_codes, flag_categories = pd.factorize(ts.data["flags"])
+    arrays = {
+        "index": ts.data.index.asi8,
+        "values": ts.data["value"].to_numpy(dtype=np.float64),
+        "flag_codes": flag_codes.astype(np.int32),
+    }
+    meta = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "header": header,
+        "flag_categories": [str(x) for x in flag_categories],
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        # Readers of a cache being updated will find meta.json missing or old
+        os.remove(os.path.join(cache_dir, "meta.json"))
+    except FileNotFoundError:
+        pass
+    for name, array in arrays.items():
+        _write_atomically(cache_dir, name + ".npy", array)
+    _write_atomically(cache_dir, "meta.json", json.dumps(meta))
+    return meta
+
+
+def _read_header(f):
+    lines = []
+    for line in f:
+        if not line.strip():
+            break
+        lines.append(line)
+    return "".join(lines)
+
+
+def _write_atomically(dirname, filename, content):
+    """Write a string, or a numpy array in .npy format, to dirname/filename."""
+    with tempfile.NamedTemporaryFile("wb", dir=dirname, delete=False) as f:
+        try:
+            if isinstance(content, str):
+                f.write(content.encode())
+            else:
+                np.save(f, content)
+        except Exception:
+            os.remove(f.name)
+            raise
+    os.replace(f.name, os.path.join(dirname, filename))
+
+
+def _get_timeseries(meta, arrays, start_date, default_tzinfo):
+    ts = HTimeseries(
+        StringIO(meta["header"] + "\n"),
+        format=HTimeseries.FILE,
+        default_tzinfo=default_tzinfo,
+    )
+    tz = ts.data.index.tz
+    index = arrays["index"]
+    start = 0
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        if start_date.tzinfo is None:
+            start_date = start_date.tz_localize(tz)
+        start = np.searchsorted(index, start_date.value)
+    index = pd.DatetimeIndex(index[start:].view("datetime64[ns]"), name="date")
+    flags = pd.Categorical.from_codes(
+        arrays["flag_codes"][start:], categories=meta["flag_categories"]
+    )
+    ts.data = pd.DataFrame(
+        {"value": arrays["values"][start:], "flags": flags},
+        index=index.tz_localize(dt.timezone.utc).tz_convert(tz),
+        copy=False,
+    )
+    return ts
@@ -6,15 +6,20 @@ import sys
 import traceback
 
 import click
-from htimeseries import HTimeseries
 
-from haggregate import RegularizationMode, aggregate
-from haggregate.regularize import regularize
+from haggregate.manifest import FILENAME as MANIFEST_FILENAME
+from haggregate.manifest import Manifest
 
 
 @click.command()
+@click.option(
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of time series to process in parallel (overrides workers)",
+)
 @click.argument("configfile")
-def main(configfile):
+def main(configfile, jobs):
     """Create lower-step timeseries from higher-step ones"""
 
     # Start by setting logger to stdout; later we will switch it according to config
@@ -37,6 +42,22 @@ def main(configfile):
         target_timestamp_offset = config.get(
             "General", "target_timestamp_offset", fallback=None
         )
+        target_timezone = config.get("General", "target_timezone", fallback=None)
+        incremental = config.getboolean("General", "incremental", fallback=False)
+        profile = config.getboolean("General", "profile", fallback=False) or (
+            os.environ.get("HAGGREGATE_PROFILE", "").lower() in ("1", "true", "yes")
+        )
+        stats_file = config.get("General", "stats_file", fallback=None)
+        use_cache = config.getboolean("General", "cache", fallback=False)
+        workers = jobs
+        if workers is None:
+            workers = config.getint("General", "workers", fallback=1)
+        if workers < 1:
+            raise click.ClickException("The number of workers must be at least 1")
+        pipeline = config.getint("General", "pipeline", fallback=0)
+        skip_unchanged = config.getboolean("General", "skip_unchanged", fallback=False)
+        if pipeline < 0:
+            raise click.ClickException("The pipeline depth must not be negative")
 
         # Remove [General] and make sure there are more sections
         config.pop("General")
@@ -53,30 +74,63 @@ def main(configfile):
         logger.info("Starting haggregate, " + dt.datetime.today().isoformat())
 
         # Read each section and do the work for it
+        sections = []
         for section_name in config.sections():
             section = config[section_name]
-            source_filename = os.path.join(base_dir, section.get("source_file"))
-            target_filename = os.path.join(base_dir, section.get("target_file"))
-            method = section.get("method")
-            with open(source_filename, newline="\n") as f:
-                ts = HTimeseries(
-                    f, format=HTimeseries.FILE, default_tzinfo=dt.timezone.utc
-                )
-            if method == "mean":
-                regularization_mode = RegularizationMode.INSTANTANEOUS
-            else:
-                regularization_mode = RegularizationMode.INTERVAL
-            regts = regularize(ts, new_date_flag="DATEINSERT", mode=regularization_mode)
-            aggts = aggregate(
-                regts,
-                target_step,
-                method,
-                min_count=min_count,
-                missing_flag=missing_flag,
-                target_timestamp_offset=target_timestamp_offset,
+            sections.append(
+                {
+                    "section_name": section_name,
+                    "source_filename": os.path.join(
+                        base_dir, section.get("source_file")
+                    ),
+                    "target_filename": os.path.join(
+                        base_dir, section.get("target_file")
+                    ),
+                    "method": section.get("method"),
+                    "target_step": section.get("target_step", target_step),
+                    "min_count": section.getint("min_count", min_count),
+                    "missing_flag": section.get("missing_flag", missing_flag),
+                    "target_timestamp_offset": section.get(
+                        "target_timestamp_offset", target_timestamp_offset
+                    ),
+                    "target_timezone": section.get("target_timezone", target_timezone),
+                    "incremental": incremental,
+                    "profile": profile,
+                    "stats_file": stats_file,
+                    "use_cache": use_cache,
+                }
+            )
+        # Skip the sections whose inputs haven't changed since they were processed
+        pending = sections
+        if skip_unchanged:
+            manifest = Manifest(os.path.join(base_dir, MANIFEST_FILENAME))
+            inputs = {s["section_name"]: manifest.get_inputs(s) for s in sections}
+            pending = [
+                s
+                for s in sections
+                if not manifest.is_unchanged(s, inputs[s["section_name"]])
+            ]
+            logger.info(
+                "Skipping {} unchanged time series".format(len(sections) - len(pending))
+            )
+
+        # The processing module imports pandas, which takes most of the startup
+        # time, so it is imported only when there is work to do
+        failed = []
+        if pending:
+            from haggregate import processing
+
+            failed = processing.process(pending, workers, pipeline)
+
+        if skip_unchanged:
+            for section in pending:
+                if section["section_name"] not in failed:
+                    manifest.update(section, inputs[section["section_name"]])
+            manifest.save()
+        if failed:
+            raise click.ClickException(
+                "{} of {} time series failed".format(len(failed), len(sections))
             )
-            with open(target_filename, "w") as f:
-                aggts.write(f, format=HTimeseries.FILE)
 
         # Log end of execution
         logger.info("Finished haggregate, " + dt.datetime.today().isoformat())
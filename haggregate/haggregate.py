@@ -1,18 +1,225 @@
+import copy
+import datetime as dt
+import functools
 import re
 from enum import Enum
 
 import numpy as np
 import pandas as pd
-from htimeseries import HTimeseries
+from htimeseries import HTimeseries, TzinfoFromString
+
+from . import profiling
+
+
+def _sum(values, starts, ends, counts=None):
+    """Sum the values in each bin, ignoring NaNs.
+
+    Each bin consists of values[starts[i]:ends[i]] and has counts[i] non-null values
+    (all methods receive the counts, but _sum doesn't need them). The bins that have
+    the same length are summed at once as the rows of a 2-D array; NumPy sums each
+    row pairwise, as pd.Series.sum does, so the results are bit-identical to those
+    of pd.Series.sum. Normally all bins have the same length, which only varies for
+    months, for days with DST changes, and if records are missing.
+    """
+    values = np.where(np.isnan(values), 0.0, values)
+    lengths = ends - starts
+    result = np.zeros((len(starts),) + values.shape[1:])
+    for length in np.unique(lengths[lengths > 0]):
+        bins = np.flatnonzero(lengths == length)
+        # Runs of contiguous bins (not separated by bins of other lengths) are
+        # contiguous parts of values, which are reshaped without copying.
+        breaks = np.flatnonzero(starts[bins[1:]] != ends[bins[:-1]]) + 1
+        if len(breaks) * 8 > len(bins):
+            # Too many short runs to loop over
+            result[bins] = _sum_rows(values[starts[bins, None] + np.arange(length)])
+            continue
+        for run in np.split(bins, breaks):
+            first = starts[run[0]]
+            end = first + len(run) * length
+            rows = values[first:end].reshape((len(run), length) + values.shape[1:])
+            result[run] = _sum_rows(rows)
+    return result
+
+
+def _sum_rows(rows):
+    """Sum along axis 1, as np.sum does for each row separately."""
+    if rows.shape[1] < 8:
+        # NumPy adds fewer than 8 values in sequence; adding the columns is faster
+        # than reducing many short rows.
+        result = rows[:, 0].copy()
+        for i in range(1, rows.shape[1]):
+            result += rows[:, i]
+        return result
+    # The summed axis must be the last (contiguous) one to be summed pairwise
+    return np.ascontiguousarray(np.moveaxis(rows, 1, -1)).sum(axis=-1)
+
+
+def _mean(values, starts, ends, counts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, _sum(values, starts, ends) / counts, np.nan)
+
+
+def _count(values, starts, ends):
+    cumulative_counts = np.cumsum(~np.isnan(values), axis=0)
+    zeros = np.zeros((1,) + values.shape[1:], dtype=cumulative_counts.dtype)
+    cumulative_counts = np.concatenate((zeros, cumulative_counts))
+    return cumulative_counts[ends] - cumulative_counts[starts]
+
+
+def _reduceat(ufunc, values, starts, ends):
+    result = np.full((len(starts),) + values.shape[1:], np.nan)
+    nonempty = ends > starts
+    if nonempty.any():
+        # The bins are contiguous, so each nonempty bin extends up to the start of
+        # the next nonempty one.
+        result[nonempty] = ufunc.reduceat(values[: ends[-1]], starts[nonempty])
+    return result
+
+
+def _max(values, starts, ends, counts):
+    return _reduceat(np.fmax, values, starts, ends)
+
+
+def _min(values, starts, ends, counts):
+    return _reduceat(np.fmin, values, starts, ends)
+
+
+def _std(values, starts, ends, counts):
+    """Sample standard deviation (with ddof=1, as in pandas)."""
+    mean = _mean(values, starts, ends, counts)
+    first, end = starts[0], ends[-1]
+    deviations = values[first:end] - np.repeat(mean, ends - starts, axis=0)
+    squares = _sum(deviations**2, starts - first, ends - first)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+
+
+def _percentile(q):
+    """Return a method that calculates the q-th percentile, like np.nanpercentile."""
+
+    def percentile(values, starts, ends, counts):
+        if values.ndim == 2:
+            return np.column_stack(
+                [
+                    percentile(column, starts, ends, column_counts)
+                    for column, column_counts in zip(values.T, counts.T)
+                ]
+            ).reshape(counts.shape)
+        # Sort the values of each bin, with the NaNs at the end of the bin
+        bins = np.repeat(np.arange(len(starts)), ends - starts)
+        first, end = starts[0], ends[-1]
+        sorted_values = values[first:end][np.lexsort((values[first:end], bins))]
+        sorted_values = np.append(sorted_values, np.nan)  # For empty bins
+        position = np.where(counts > 0, q / 100 * (counts - 1), 0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        starts = np.where(counts > 0, starts - first, len(sorted_values) - 1)
+        lower_values = sorted_values[starts + lower]
+        upper_values = sorted_values[starts + upper]
+        return lower_values + (upper_values - lower_values) * (position - lower)
+
+    return percentile
+
+
+def _valid_positions(values):
+    """Return the positions of the previous and next non-null value of each value.
+
+    The results have an additional element before and after, respectively, so that
+    they can be indexed with ends and starts; -1 and len(values) mean none.
+    """
+    n = len(values)
+    edge_shape = (1,) + values.shape[1:]
+    positions = np.arange(n).reshape((-1,) + (1,) * (values.ndim - 1))
+    valid = ~np.isnan(values)
+    previous_valid = np.maximum.accumulate(np.where(valid, positions, -1), axis=0)
+    next_valid = np.minimum.accumulate(np.where(valid, positions, n)[::-1], axis=0)
+    return (
+        np.concatenate((np.full(edge_shape, -1), previous_valid)),
+        np.concatenate((next_valid[::-1], np.full(edge_shape, n))),
+    )
+
+
+def _take(values, positions):
+    """Return values[positions] (in each column if 2-D), with NaN at -1."""
+    padded = np.concatenate((values, np.full((1,) + values.shape[1:], np.nan)))
+    positions = np.broadcast_to(positions, positions.shape[:1] + values.shape[1:])
+    return np.take_along_axis(padded, positions, axis=0)
+
+
+def _expand(array, ndim):
+    """Add trailing axes to array, so that it has ndim dimensions."""
+    return array.reshape(array.shape + (1,) * (ndim - array.ndim))
+
+
+def _first(values, starts, ends, counts):
+    previous_valid, next_valid = _valid_positions(values)
+    positions = next_valid[starts]
+    positions[positions >= _expand(ends, values.ndim)] = -1
+    return _take(values, positions)
+
+
+def _last(values, starts, ends, counts):
+    previous_valid, next_valid = _valid_positions(values)
+    positions = previous_valid[ends]
+    positions[positions < _expand(starts, values.ndim)] = -1
+    return _take(values, positions)
+
+
+def _vector_mean(values, starts, ends, counts):
+    """Direction of the mean of unit vectors with the values as directions.
+
+    The values are in degrees, as is the result, which is between 0 and 360.
+    """
+    radians = np.deg2rad(values)
+    sin_sum = _sum(np.sin(radians), starts, ends)
+    cos_sum = _sum(np.cos(radians), starts, ends)
+    directions = np.rad2deg(np.arctan2(sin_sum, cos_sum)) % 360
+    directions[directions == 360] = 0  # A tiny negative angle gives 360 when rounded
+    return np.where(counts > 0, directions, np.nan)
+
+
+def _time_of_max(values, starts, ends, counts):
+    """Return the positions of the (first) maximum values (-1 if none)."""
+    lengths = ends - starts
+    maxima = np.repeat(_max(values, starts, ends, counts), lengths, axis=0)
+    first, end = starts[0], ends[-1]
+    positions = np.arange(first, end).reshape((-1,) + (1,) * (values.ndim - 1))
+    is_max = values[first:end] == maxima
+    candidates = np.where(is_max, positions, end)
+    result = np.full(counts.shape, -1)
+    nonempty = lengths > 0
+    if nonempty.any():
+        reduced = np.minimum.reduceat(candidates, starts[nonempty] - first, axis=0)
+        result[nonempty] = np.where(reduced < end, reduced, -1)
+    return result
+
+
+_time_of_max.returns_positions = True
 
 methods = {
-    "sum": pd.Series.sum,
-    "mean": pd.Series.mean,
-    "max": pd.Series.max,
-    "min": pd.Series.min,
+    "sum": _sum,
+    "mean": _mean,
+    "max": _max,
+    "min": _min,
+    "std": _std,
+    "median": _percentile(50),
+    "first": _first,
+    "last": _last,
+    "vector_mean": _vector_mean,
+    "time_of_max": _time_of_max,
 }
 
 
+def _get_method(name):
+    """Return the function of a method, which may also be a percentile like "p90"."""
+    if name in methods:
+        return methods[name]
+    m = re.match(r"p(\d+(\.\d*)?)$", name)
+    if m and float(m.group(1)) <= 100:
+        return _percentile(float(m.group(1)))
+    raise AggregateError('Unknown aggregation method "{}"'.format(name))
+
+
 class AggregateError(Exception):
     pass
 
@@ -24,6 +231,8 @@ def aggregate(
     min_count=1,
     missing_flag="MISS",
     target_timestamp_offset=None,
+    extra_methods=(),
+    target_timezone=None,
 ):
     aggregation = Aggregation(
         source_timeseries=hts,
@@ -32,13 +241,270 @@ def aggregate(
         min_count=min_count,
         missing_flag=missing_flag,
         target_timestamp_offset=target_timestamp_offset,
+        extra_methods=extra_methods,
+        target_timezone=target_timezone,
     )
     aggregation.execute()
     return aggregation.result
 
 
+def aggregate_iter(
+    chunks,
+    target_step,
+    method,
+    min_count=1,
+    missing_flag="MISS",
+    target_timestamp_offset=None,
+    extra_methods=(),
+    target_timezone=None,
+):
+    """Aggregate a time series that is provided in chunks.
+
+    "chunks" is an iterable of HTimeseries objects with consecutive parts of a time
+    series, in chronological order. AggregatedTimeseries objects are yielded with
+    the records of the target intervals that have closed, as soon as they have
+    closed; the concatenation of their data is the same as the data of the result
+    of aggregate() for the whole time series. Only the source records of the
+    interval that is still open are kept between chunks.
+    """
+    aggregation = StreamingAggregation(
+        chunks=chunks,
+        target_step=target_step,
+        method=method,
+        min_count=min_count,
+        missing_flag=missing_flag,
+        target_timestamp_offset=target_timestamp_offset,
+        extra_methods=extra_methods,
+        target_timezone=target_timezone,
+    )
+    return aggregation.execute()
+
+
+def aggregate_arrays(
+    index_ns, values, source_step, target_step, method, min_count=1, tz=None
+):
+    """Aggregate a time series given as arrays, without creating pandas objects.
+
+    index_ns are the sorted timestamps as int64 nanoseconds since the epoch, which
+    must be a regular time series with step source_step (though records may be
+    missing), and values are float64. The bins are closed and labelled on the right;
+    their edges are calculated in the time zone tz (UTC if None), so that, e.g.,
+    daily bins end at local midnight. Returns a tuple (index_ns, values, counts,
+    missing_mask), where counts are the numbers of non-null source values in the
+    bins, and missing_mask is True where these are fewer than the maximum possible.
+
+    values may also be a 2-D array with a column for each of many time series that
+    have the same timestamps; the returned values, counts and missing_mask are then
+    2-D as well.
+
+    method may also be a list of methods, which are calculated on the same bins;
+    the returned values is then a dict with the result of each method. The result
+    of "time_of_max" is int64 nanoseconds since the epoch (NaT where null).
+    """
+    step = _parse_step(target_step)
+    source_step = pd.Timedelta(source_step)
+    if not _is_multiple(step, source_step):
+        raise AggregateError("The target step must be a multiple of the source step")
+    names = [method] if isinstance(method, str) else list(method)
+    kernels = [_get_method(name) for name in names]
+    index_ns = np.asarray(index_ns, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if not len(index_ns):
+        shape = (0,) + values.shape[1:]
+        results = {
+            name: np.empty(shape, dtype=_get_dtype(kernel))
+            for name, kernel in zip(names, kernels)
+        }
+        result_values = results[method] if isinstance(method, str) else results
+        return (
+            np.empty(0, dtype=np.int64),
+            result_values,
+            np.empty(shape, dtype=np.int64),
+            np.empty(shape, dtype=bool),
+        )
+    plan = _get_plan(index_ns[0], index_ns[-1], source_step, target_step, tz)
+    if plan.edges[-1] < index_ns[-1]:
+        # Otherwise the records after the last edge would be silently ignored
+        raise AggregateError("The bins end before the last record; this is a bug")
+    filled_values = _fill_missing(index_ns, values, plan)
+    if filled_values is None:
+        positions = np.searchsorted(index_ns, plan.edges, side="right")
+    else:
+        values, positions = filled_values, plan.positions
+    starts, ends = positions[:-1], positions[1:]
+    counts = _count(values, starts, ends)
+    too_few = counts < min_count
+    results = {}
+    for name, kernel in zip(names, kernels):
+        result = kernel(values, starts, ends, counts)
+        if getattr(kernel, "returns_positions", False):
+            if filled_values is None:
+                timestamps = index_ns[result]
+            else:
+                timestamps = plan.get_timestamps(result)
+            result = np.where((result >= 0) & ~too_few, timestamps, _NAT)
+        else:
+            result[too_few] = np.nan
+        results[name] = result
+    result_values = results[method] if isinstance(method, str) else results
+    max_counts = _expand(plan.max_counts, values.ndim)
+    return plan.edges[1:].copy(), result_values, counts, counts < max_counts
+
+
+_NAT = np.iinfo(np.int64).min  # The int64 representation of NaT
+
+
+def _fill_missing(index_ns, values, plan):
+    """Return values with null records added before the first and after the last.
+
+    The result has a record for each source step of the bins of plan, so that the
+    first and last bins have their full length and their values are summed in the
+    same way as those of the other bins. Returns None if records are missing
+    between the first and the last or are not aligned with the bin edges; the bins
+    must then be found with np.searchsorted.
+    """
+    step = plan.source_step
+    first_slot, remainder = divmod(int(index_ns[0] - plan.edges[0]), step)
+    if remainder or not (np.diff(index_ns) == step).all():
+        return None
+    start, end = first_slot - 1, first_slot - 1 + len(index_ns)
+    if start == 0 and end == plan.positions[-1]:
+        return values
+    result = np.full((plan.positions[-1],) + values.shape[1:], np.nan)
+    result[start:end] = values
+    return result
+
+
+def _get_dtype(kernel):
+    return np.int64 if getattr(kernel, "returns_positions", False) else np.float64
+
+
+def aggregate_frame(
+    data,
+    target_step,
+    method,
+    min_count=1,
+    missing_flag="MISS",
+    target_timestamp_offset=None,
+    source_step=None,
+    target_timezone=None,
+):
+    """Aggregate many time series that have the same timestamps at once.
+
+    data is a DataFrame with a DatetimeIndex and a column of values for each time
+    series; source_step is found from the timestamps if not specified, and
+    target_timezone is as in aggregate(). Returns a tuple (values, flags) of
+    DataFrames with the same columns as data, without the leading and trailing
+    records in which all values are null.
+    """
+    if source_step is None:
+        source_step = _get_step(data.index.asi8)
+    tz = _get_target_timezone(target_timezone, data.index.tz)
+    result_index, values, counts, missing = aggregate_arrays(
+        data.index.asi8,
+        data.to_numpy(dtype=np.float64),
+        source_step,
+        target_step,
+        method,
+        min_count,
+        tz=tz,
+    )
+    not_null = np.flatnonzero(~np.isnan(values).all(axis=1))
+    first, end = (not_null[0], not_null[-1] + 1) if len(not_null) else (0, 0)
+    index = _to_datetime_index(result_index[first:end], tz)
+    index.name = data.index.name
+    result_values = pd.DataFrame(values[first:end], index=index, columns=data.columns)
+    result_flags = pd.DataFrame(
+        {
+            i: _get_missing_flags(column, missing_flag)
+            for i, column in enumerate(missing[first:end].T)
+        },
+        index=index,
+    )
+    result_flags.columns = data.columns
+    return (
+        _add_timestamp_offset(result_values, target_timestamp_offset),
+        _add_timestamp_offset(result_flags, target_timestamp_offset),
+    )
+
+
+class _AggregationPlan:
+    """The bins that contain a range of timestamps.
+
+    "edges" are the int64 nanoseconds of the edges of the bins, and "max_counts" is
+    the number of source records each bin has if none is missing. If the source has
+    a record at each source step between the first and last edges, bin i consists
+    of the records positions[i] to positions[i + 1]. The arrays are read-only, as
+    plans are shared by all time series with the same bins.
+    """
+
+    def __init__(self, edges, max_counts, source_step):
+        self.edges = edges
+        self.max_counts = max_counts
+        self.positions = np.concatenate(([0], np.cumsum(max_counts)))
+        self.source_step = source_step
+        for array in (edges, max_counts, self.positions):
+            array.setflags(write=False)
+
+    def get_timestamps(self, positions):
+        """Return the timestamps (int64 ns) of the records at positions."""
+        return self.edges[0] + (positions + 1) * self.source_step
+
+
+def _get_plan(first, last, source_step, target_step, tz):
+    """Return the _AggregationPlan for the timestamps first to last (int64 ns)."""
+    step = _parse_step(target_step)
+    tz = _normalize_tz(tz)
+    first, last = pd.to_datetime([first - 1, last], utc=True).tz_convert(tz)
+    first_edge = _floor(first, step).value
+    if _is_wall_clock_step(step):
+        last_edge = _ceil(last, step).value
+    else:
+        # The bins are spaced by step in absolute time, which differs from wall
+        # clock time across a DST change, so the last edge is counted in steps
+        # from the first rather than found with _ceil.
+        last_edge = first_edge - (first_edge - last.value) // step.value * step.value
+    return _create_plan(
+        first_edge,
+        last_edge,
+        source_step.value,
+        target_step,
+        tz,
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _create_plan(first_edge, last_edge, source_step, target_step, tz):
+    step = _parse_step(target_step)
+    first_edge, last_edge = pd.to_datetime([first_edge, last_edge], utc=True)
+    edges = pd.date_range(
+        first_edge.tz_convert(tz), last_edge.tz_convert(tz), freq=step
+    ).asi8
+    return _AggregationPlan(edges, np.diff(edges) // source_step, source_step)
+
+
+def _is_wall_clock_step(step):
+    """Return whether pd.date_range() spaces bins of step in wall clock time.
+
+    This is the case for months and whole days; shorter steps are spaced in
+    absolute time, even across a DST change.
+    """
+    return isinstance(step, pd.DateOffset) or not step % pd.Timedelta("1D")
+
+
+def _normalize_tz(tz):
+    """Return tz, or a dt.timezone if it has a fixed offset.
+
+    Time zones with the same fixed offset are then equal, so that they share plans.
+    """
+    offset = tz.utcoffset(None) if isinstance(tz, dt.tzinfo) else None
+    return tz if offset is None else dt.timezone(offset)
+
+
 class Aggregation:
     def __init__(self, **kwargs):
+        self.extra_methods = ()
+        self.target_timezone = None
         for key, value in kwargs.items():
             setattr(self, key, value)
         self.source = SourceTimeseries(self.source_timeseries)
@@ -46,37 +512,210 @@ class Aggregation:
         self.result.time_step = self.target_step
 
     def execute(self):
-        self.result.set_metadata(self.source_timeseries)
-        try:
-            self.source.normalize(self.target_step)
-        except CannotInferFrequency:
-            return
+        self.result.set_metadata(self.source_timeseries, self.target_timezone)
+        with profiling.stage("get_step") as stage:
+            try:
+                self.source.freq = self.source.get_step()
+            except CannotInferFrequency:
+                return
+            stage.result = self.source
         self.do_aggregation()
-        self.result.remove_leading_and_trailing_nans()
-        self.result.add_timestamp_offset(self.target_timestamp_offset)
+        with profiling.stage("trim") as stage:
+            self.result.remove_leading_and_trailing_nans()
+            self.result.add_timestamp_offset(self.target_timestamp_offset)
+            stage.result = self.result
 
     def do_aggregation(self):
-        self.create_resampler()
-        self.get_result_values()
-        self.get_result_flags()
+        if _get_dtype(_get_method(self.method)) != np.float64:
+            raise AggregateError(
+                '"{}" can only be one of the extra methods'.format(self.method)
+            )
+        source_index = self.source.data.index
+        tz = _get_target_timezone(self.target_timezone, source_index.tz)
+        with profiling.stage("aggregate") as stage:
+            result_index, results, counts, missing = aggregate_arrays(
+                source_index.asi8,
+                self.source.data["value"].to_numpy(dtype=np.float64),
+                self.source.freq,
+                self.target_step,
+                [self.method, *self.extra_methods],
+                self.min_count,
+                tz=tz,
+            )
+            stage.result = results[self.method]
+        with profiling.stage("flags"):
+            flags = self.get_result_flags(missing)
+        columns = {"value": results[self.method], "flags": flags}
+        for name in self.extra_methods:
+            columns[name] = results[name]
+            if results[name].dtype == np.int64:
+                columns[name] = _to_datetime_index(results[name], tz)
+        self.result.data = pd.DataFrame(
+            columns, index=_to_datetime_index(result_index, tz)
+        )
+        # Named like the source index, or "date" (as in HTimeseries) if it has no name
+        self.result.data.index.name = source_index.name or "date"
+
+    def get_result_flags(self, missing):
+        return _get_missing_flags(missing, self.missing_flag)
+
 
-    def create_resampler(self):
-        self.resampler = self.source.data["value"].resample(
-            self.result.time_step, closed="right", label="right"
+def _to_datetime_index(index_ns, tz):
+    """Convert int64 nanoseconds since the epoch to a DatetimeIndex in tz."""
+    index = pd.DatetimeIndex(index_ns.view("datetime64[ns]"))
+    return index.tz_localize("UTC").tz_convert(tz)
+
+
+def _get_target_timezone(target_timezone, source_tz):
+    """Return the time zone in which to aggregate, as a tzinfo.
+
+    target_timezone may be a string such as "+0200" or "EET (+0200)", as in the
+    Timezone of htimeseries files, a tzinfo, or None for source_tz.
+    """
+    if target_timezone is None:
+        return source_tz
+    if not isinstance(target_timezone, str):
+        return target_timezone
+    return _parse_timezone(target_timezone)
+
+
+@functools.lru_cache(maxsize=16)
+def _parse_timezone(string):
+    # Cached so that the results of all chunks of aggregate_iter() have the same
+    # tzinfo object and can be concatenated
+    try:
+        return TzinfoFromString(string)
+    except ValueError:
+        raise AggregateError(
+            'The target time zone "{}" is invalid; it must be like "+0200"'.format(
+                string
+            )
         )
 
-    def get_result_values(self):
-        result_values = self.resampler.agg(methods[self.method])
-        values_count = self.resampler.count()
-        result_values[values_count < self.min_count] = np.nan
-        self.result.data["value"] = result_values
-
-    def get_result_flags(self):
-        max_count = int(pd.Timedelta(self.result.time_step) / self.source.freq)
-        values_count = self.resampler.count()
-        self.result.data["flags"] = (values_count < max_count).apply(
-            lambda x: self.missing_flag if x else ""
+
+def _get_missing_flags(missing, missing_flag):
+    categories = ["", missing_flag] if missing_flag else [""]
+    codes = np.where(missing, len(categories) - 1, 0).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+class StreamingAggregation:
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self.first_chunk = None
+        self.freq = None
+        self.open_interval_data = None  # Source records of the open interval
+        self.last_source_timestamp = None
+        self.last_label = None
+        self.started = False  # Whether any non-null result record has been found
+        self.trailing_nulls = []  # Null result records not yet yielded
+
+    def execute(self):
+        for chunk in self.chunks:
+            if self.first_chunk is None:
+                self.first_chunk = chunk
+            data = chunk.data
+            if self.open_interval_data is not None:
+                data = pd.concat([self.open_interval_data, data])
+            if not len(data):
+                continue
+            if not self.infer_freq(data):
+                self.open_interval_data = data
+                continue
+            last_timestamp = data.index[-1]
+            if self.target_timezone is not None:
+                tz = _get_target_timezone(self.target_timezone, None)
+                last_timestamp = last_timestamp.tz_convert(tz)
+            closed_until = _floor(last_timestamp, _parse_step(self.target_step))
+            self.open_interval_data = data[data.index > closed_until]
+            result = self.aggregate_closed(data[data.index <= closed_until])
+            if result is not None:
+                yield result
+        data = self.open_interval_data
+        if data is not None and len(data) and self.infer_freq(data, final=True):
+            result = self.aggregate_closed(data)
+            if result is not None:
+                yield result
+
+    def infer_freq(self, data, final=False):
+        """Set self.freq, unless it's already set; return False if it can't be found.
+
+        Unless the data is final, the step is not taken from the time_step attribute
+        when there is a single record, so that it is found from the timestamps, as
+        aggregate() does.
+        """
+        if self.freq is not None:
+            return True
+        if len(data) < 2 and not final:
+            return False
+        source = SourceTimeseries(self.first_chunk)
+        source.data = data
+        try:
+            self.freq = source.get_step()
+        except CannotInferFrequency:
+            return False
+        return True
+
+    def aggregate_closed(self, data):
+        if not len(data):
+            return None
+        self.check_regularity(data)
+        source_timeseries = copy.copy(self.first_chunk)
+        source_timeseries.data = data
+        aggregation = Aggregation(
+            source_timeseries=source_timeseries,
+            target_step=self.target_step,
+            method=self.method,
+            min_count=self.min_count,
+            missing_flag=self.missing_flag,
+            extra_methods=self.extra_methods,
+            target_timezone=self.target_timezone,
         )
+        aggregation.result.set_metadata(source_timeseries, self.target_timezone)
+        aggregation.source.freq = self.freq
+        aggregation.do_aggregation()
+        result = aggregation.result
+        if self.last_label is not None:
+            # The first interval was closed in a previous chunk
+            result.data = result.data[result.data.index > self.last_label]
+        self.last_label = result.data.index[-1]
+        return self.release(result)
+
+    def check_regularity(self, data):
+        timestamps = data.index.asi8
+        if self.last_source_timestamp is not None:
+            timestamps = np.concatenate(([self.last_source_timestamp], timestamps))
+        if not _has_step(timestamps, self.freq.value):
+            raise AggregateError(
+                "Can't infer time series step; maybe it's not regularized"
+            )
+        self.last_source_timestamp = timestamps[-1]
+
+    def release(self, result):
+        """Return result without leading and trailing nulls, or None if it's empty.
+
+        Trailing nulls are withheld and are prepended to the next result that has
+        non-null records (if there is none, they are trailing nulls of the whole
+        time series and are never released).
+        """
+        data = result.data
+        not_null = np.flatnonzero(data["value"].notna().values)
+        if not self.started:
+            if not len(not_null):
+                return None
+            first = not_null[0]
+            data = data.iloc[first:]
+            not_null -= first
+            self.started = True
+        if not len(not_null):
+            self.trailing_nulls.append(data)
+            return None
+        end = not_null[-1] + 1
+        result.data = pd.concat(self.trailing_nulls + [data.iloc[:end]])
+        self.trailing_nulls = [data.iloc[end:]]
+        result.add_timestamp_offset(self.target_timestamp_offset)
+        return result
 
 
 class CannotInferFrequency(Exception):
@@ -90,33 +729,37 @@ class SourceTimeseries(HTimeseries):
     def __init__(self, s):
         for attr in attrs:
             setattr(self, attr, getattr(s, attr, None))
+        self.time_step = getattr(s, "time_step", None)
         self.data = s.data
 
-    def normalize(self, target_step):
-        """Reindex so that it has no missing records but has NaNs instead, starting from
-        one before and ending in one after.
+    def get_step(self):
+        """Return the step of the time series, checking that it is regular.
+
+        The step is found from the first two timestamps; if there are fewer, it is
+        taken from the time_step attribute. Raises CannotInferFrequency if there are
+        too few records to find the step (fewer than three if time_step isn't
+        specified), and AggregateError if the time series is not regular.
         """
-        current_range = self.data.index
+        return _get_step(self.data.index.asi8, self.get_declared_step())
+
+    def get_declared_step(self):
+        """Return the time_step attribute as a pd.Timedelta, or None if unusable."""
+        if not self.time_step:
+            return None
         try:
-            self.freq = pd.tseries.frequencies.to_offset(pd.infer_freq(current_range))
-            if self.freq is None:
-                raise AggregateError(
-                    "Can't infer time series step; maybe it's not regularized"
-                )
-        except ValueError:
-            raise CannotInferFrequency()
-        first_timestamp = (current_range[0] - pd.Timedelta("1S")).floor(target_step)
-        end_timestamp = current_range[-1].ceil(target_step)
-        new_range = pd.date_range(first_timestamp, end_timestamp, freq=self.freq)
-        self.data = self.data.reindex(new_range)
+            step = _parse_step(self.time_step)
+        except AggregateError:
+            return None
+        return None if isinstance(step, pd.DateOffset) else step
 
 
 class AggregatedTimeseries(HTimeseries):
-    def set_metadata(self, source_timeseries):
+    def set_metadata(self, source_timeseries, target_timezone=None):
         for attr in attrs:
             setattr(self, attr, getattr(source_timeseries, attr, None))
-        if self.time_step not in ("1H", "1D"):
-            raise AggregateError("The target step can currently only be 1H or 1D")
+        if isinstance(target_timezone, str):
+            self.timezone = target_timezone
+        _parse_step(self.time_step)
         if hasattr(source_timeseries, "title"):
             self.title = "Aggregated " + source_timeseries.title
         if hasattr(source_timeseries, "comment"):
@@ -126,16 +769,93 @@ class AggregatedTimeseries(HTimeseries):
             )
 
     def remove_leading_and_trailing_nans(self):
-        while len(self.data.index) > 0 and pd.isnull(self.data["value"]).iloc[0]:
-            self.data = self.data.drop(self.data.index[0])
-        while len(self.data.index) > 0 and pd.isnull(self.data["value"]).iloc[-1]:
-            self.data = self.data.drop(self.data.index[-1])
+        not_null = np.flatnonzero(self.data["value"].notna().values)
+        if len(not_null):
+            first, end = not_null[0], not_null[-1] + 1
+            self.data = self.data.iloc[first:end]
+        else:
+            self.data = self.data.iloc[:0]
 
     def add_timestamp_offset(self, target_timestamp_offset):
-        if target_timestamp_offset:
-            periods = target_timestamp_offset.startswith("-") and 1 or -1
-            freq = target_timestamp_offset.lstrip("-")
-            self.data = self.data.shift(periods, freq=freq)
+        self.data = _add_timestamp_offset(self.data, target_timestamp_offset)
+
+
+def _add_timestamp_offset(data, target_timestamp_offset):
+    if target_timestamp_offset:
+        periods = target_timestamp_offset.startswith("-") and 1 or -1
+        freq = target_timestamp_offset.lstrip("-")
+        data = data.shift(periods, freq=freq)
+    return data
+
+
+def _get_step(timestamps, declared_step=None):
+    """Return the step of the timestamps, checking that it is regular.
+
+    See SourceTimeseries.get_step(), which uses declared_step if there is a single
+    timestamp.
+    """
+    if not len(timestamps) or (len(timestamps) < 3 and declared_step is None):
+        raise CannotInferFrequency()
+    if len(timestamps) > 1:
+        step = timestamps[1] - timestamps[0]
+    else:
+        step = declared_step.value
+    if step <= 0 or not _has_step(timestamps, step):
+        raise AggregateError("Can't infer time series step; maybe it's not regularized")
+    return pd.Timedelta(step)
+
+
+def _parse_step(target_step):
+    """Return the target step as a pd.Timedelta, or as a pd.DateOffset if in months."""
+    m = re.match(r"([1-9]\d*)?M$", target_step)
+    if m:
+        return pd.DateOffset(months=int(m.group(1) or 1))
+    try:
+        # pandas<2 parses years as a fixed number of days, and "M" as minutes
+        step = None if re.search("[MYy]$", target_step) else pd.Timedelta(target_step)
+    except ValueError:
+        step = None
+    if step is None or step <= pd.Timedelta(0):
+        raise AggregateError(
+            "The target step must be a fixed step such as 10min, 3H or 1D, or a "
+            "number of months such as 1M"
+        )
+    return step
+
+
+def _has_step(timestamps, step, chunk_size=65536):
+    """Return whether all consecutive timestamps differ by step.
+
+    The timestamps are checked in chunks, so that an irregular time series is
+    usually detected without processing all of it.
+    """
+    for start in range(0, len(timestamps) - 1, chunk_size):
+        end = start + chunk_size + 1
+        if np.any(np.diff(timestamps[start:end]) != step):
+            return False
+    return True
+
+
+def _is_multiple(step, source_step):
+    if isinstance(step, pd.DateOffset):
+        # Months consist of whole days
+        step = pd.Timedelta("1D")
+    return step.value % source_step.value == 0
+
+
+def _floor(timestamp, step):
+    if not isinstance(step, pd.DateOffset):
+        return timestamp.floor(step)
+    months = timestamp.year * 12 + timestamp.month - 1
+    months -= months % step.months  # So that, e.g., quarters start in January
+    return timestamp.normalize().replace(
+        year=months // 12, month=months % 12 + 1, day=1
+    )
+
+
+def _ceil(timestamp, step):
+    result = _floor(timestamp, step)
+    return result if result == timestamp else result + step
 
 
 def _get_offset_in_minutes(timestamp_offset):
@@ -0,0 +1,81 @@
+"""Record of the inputs of processed sections, so that unchanged ones are skipped.
+
+The manifest is a JSON file that maps the target file of each section to the size
+and modification time of its source file and to the parameters of the section, as
+they were when the section was last processed successfully, and to the size and
+modification time that the target file then got. If none of these has changed, the
+target file would be recreated exactly as it is, so the section can be skipped.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+FILENAME = "haggregate-manifest.json"
+
+# Items of the section configuration (as created by the cli) that don't affect the
+# target file
+IGNORED = ("section_name", "profile", "stats_file", "use_cache")
+
+
+class Manifest:
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename) as f:
+                self.entries = json.load(f)
+            if not isinstance(self.entries, dict):
+                raise ValueError("not a JSON object")
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError as e:
+            # E.g. truncated by a crash; all sections will then be processed
+            logging.getLogger("haggregate").warning(
+                "Ignoring invalid manifest {}: {}".format(filename, str(e))
+            )
+            self.entries = {}
+
+    def get_inputs(self, section):
+        """Return the current state of the inputs of the section."""
+        return {
+            "source": _get_file_state(section["source_filename"]),
+            "parameters": {k: v for k, v in section.items() if k not in IGNORED},
+        }
+
+    def is_unchanged(self, section, inputs):
+        """Return whether the target of the section is up to date for inputs."""
+        target_filename = section["target_filename"]
+        entry = self.entries.get(os.path.abspath(target_filename))
+        return (
+            entry is not None
+            and entry["inputs"] == inputs
+            and entry["target"] == _get_file_state(target_filename)
+        )
+
+    def update(self, section, inputs):
+        """Record that the target of the section has been created from inputs."""
+        target_filename = section["target_filename"]
+        self.entries[os.path.abspath(target_filename)] = {
+            "inputs": inputs,
+            "target": _get_file_state(target_filename),
+        }
+
+    def save(self):
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=dirname, suffix=".json", delete=False
+        ) as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())  # So that a crash can't leave it incomplete
+        os.replace(f.name, self.filename)
+
+
+def _get_file_state(filename):
+    """Return the size and modification time of the file (None if it's missing)."""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
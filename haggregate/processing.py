@@ -0,0 +1,481 @@
+"""Processing of the time series sections of the configuration file of the cli."""
+
+import asyncio
+import contextlib
+import datetime as dt
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import StringIO
+
+import pandas as pd
+from htimeseries import HTimeseries
+
+from haggregate import cache, profiling
+from haggregate.haggregate import RegularizationMode, _parse_step, aggregate
+from haggregate.regularize import regularize
+
+
+def process(sections, workers=1, pipeline=0):
+    """Process the sections; returns a list of the names of those that failed.
+
+    Sections with the same source file are processed together, so that the source
+    is read only once.
+    """
+    sources = {}
+    for section in sections:
+        sources.setdefault(section["source_filename"], []).append(section)
+    if workers == 1 and pipeline:
+        return _process_pipelined(list(sources.values()), pipeline)
+    elif workers == 1:
+        return _process_sequentially(list(sources.values()))
+    else:
+        return _process_in_parallel(list(sources.values()), workers)
+
+
+def process_source(sections):
+    """Process time series sections that have the same source file.
+
+    The source is read once, and regularized once for each regularization mode, for
+    all sections. Failed sections are logged; returns a list of their names.
+    """
+    return _process_sections(sections, _prepare_source(sections))
+
+
+def _prepare_source(sections):
+    """Return the _Source of sections, requiring the data all of them need."""
+    source = _Source(sections[0]["source_filename"], sections[0]["use_cache"])
+    for section in sections:
+        if not section["incremental"]:
+            source.require(None)
+            continue
+        try:
+            start_date = _get_start_date(
+                _read_target_tail(section["target_filename"]),
+                section["target_step"],
+                section["target_timestamp_offset"],
+                section.get("target_timezone"),
+            )
+        except Exception:
+            # The section will fail when processed, and the error will be logged
+            continue
+        source.require(start_date)
+    return source
+
+
+def _process_sections(sections, source, write_target=None):
+    """Process sections whose source has been prepared with _prepare_source().
+
+    If write_target is specified, it is called with the section name followed by
+    the arguments of _write_target() instead of writing each target file; it may
+    write it later. Returns a list of the names of the failed sections.
+    """
+    failed = []
+    for section in sections:
+        write = None
+        if write_target:
+            write = functools.partial(write_target, section["section_name"])
+        try:
+            process_section(**section, source=source, write_target=write)
+        except Exception as e:
+            _log_failure(section["section_name"], e)
+            failed.append(section["section_name"])
+    return failed
+
+
+def process_section(
+    section_name,
+    source_filename,
+    target_filename,
+    method,
+    target_step,
+    min_count,
+    missing_flag,
+    target_timestamp_offset,
+    target_timezone=None,
+    incremental=False,
+    source=None,
+    profile=False,
+    stats_file=None,
+    use_cache=False,
+    write_target=None,
+):
+    logger = logging.getLogger("haggregate")
+    logger.debug("Processing " + section_name)
+    with profiling.profile(section_name) if profile else contextlib.nullcontext() as p:
+        _aggregate_section(
+            source or _Source(source_filename, use_cache),
+            target_filename,
+            method,
+            target_step,
+            min_count,
+            missing_flag,
+            target_timestamp_offset,
+            target_timezone,
+            incremental,
+            write_target or _write_target,
+        )
+    if profile:
+        logger.info("Profile of " + p.format())
+        if stats_file:
+            p.write(stats_file)
+
+
+def _aggregate_section(
+    source,
+    target_filename,
+    method,
+    target_step,
+    min_count,
+    missing_flag,
+    target_timestamp_offset,
+    target_timezone,
+    incremental,
+    write_target,
+):
+    target_tail = _read_target_tail(target_filename) if incremental else None
+    start_date = _get_start_date(
+        target_tail, target_step, target_timestamp_offset, target_timezone
+    )
+    if method in ("sum", "max", "min"):
+        regularization_mode = RegularizationMode.INTERVAL
+    else:
+        regularization_mode = RegularizationMode.INSTANTANEOUS
+    aggregate_kwargs = {
+        "min_count": min_count,
+        "missing_flag": missing_flag,
+        "target_timestamp_offset": target_timestamp_offset,
+        "target_timezone": target_timezone,
+    }
+    regts = source.get_regularized(regularization_mode, start_date)
+    aggts = aggregate(regts, target_step, method, **aggregate_kwargs)
+    if target_tail and not _starts_at_last_record(aggts, target_tail):
+        # The values of the last interval of the target have meanwhile become null,
+        # so the target must be recalculated from the beginning of the source
+        target_tail = None
+        regts = source.get_regularized(regularization_mode, None)
+        aggts = aggregate(regts, target_step, method, **aggregate_kwargs)
+    with profiling.stage("write") as stage:
+        stage.result = aggts
+        write_target(aggts, target_filename, target_tail)
+
+
+def _write_target(aggts, target_filename, target_tail):
+    if target_tail:
+        _append_to_target(aggts, target_filename, target_tail)
+        return
+    with open(target_filename, "w") as f:
+        aggts.write(f, format=HTimeseries.FILE)
+
+
+def _starts_at_last_record(aggts, target_tail):
+    """Return whether aggts has a record at the last timestamp of the target."""
+    last_timestamp = target_tail.last_timestamp.tz_localize(aggts.data.index.tz)
+    return last_timestamp in aggts.data.index
+
+
+def _get_start_date(
+    target_tail, target_step, target_timestamp_offset, target_timezone=None
+):
+    """Return the date from which the source must be read (None for all of it)."""
+    if not target_tail:
+        return None
+    # Recalculate the last record of the target, as it may have been calculated
+    # before all the data of its interval were available.
+    last_label = target_tail.last_timestamp
+    if target_timestamp_offset:
+        last_label += pd.Timedelta(target_timestamp_offset)
+    start_date = last_label - _parse_step(target_step)
+    if target_timezone:
+        # The start date is compared to the source timestamps, which are in the time
+        # zone of the source; UTC offsets range from -12:00 to +14:00.
+        start_date -= pd.Timedelta(hours=26)
+    return start_date.to_pydatetime()
+
+
+class _Source:
+    """A source file, which is read and regularized only once for all its targets.
+
+    The file is read from the earliest start date required with require() (or
+    from the beginning if a start date of None is required). If use_cache is set,
+    it is read through its binary cache (see haggregate.cache).
+    """
+
+    def __init__(self, filename, use_cache=False):
+        self.filename = filename
+        self.use_cache = use_cache
+        self.start_date = None
+        self.read_all = False
+        self.ts = None
+        self.regularized = {}
+
+    def require(self, start_date):
+        if self.read_all or (
+            start_date is not None
+            and self.start_date is not None
+            and start_date >= self.start_date
+        ):
+            return
+        if start_date is None:
+            self.read_all = True
+        else:
+            self.start_date = start_date
+        self.ts = None
+        self.regularized = {}
+
+    def get_regularized(self, mode, start_date=None):
+        self.require(start_date)
+        self.load()
+        if mode not in self.regularized:
+            with profiling.stage("regularize") as stage:
+                stage.result = regularize(
+                    self.ts, new_date_flag="DATEINSERT", mode=mode
+                )
+            self.regularized[mode] = stage.result
+        return self.regularized[mode]
+
+    def load(self):
+        """Read the source file, unless it has already been read."""
+        if self.ts is None:
+            with profiling.stage("read") as stage:
+                stage.result = self.read()
+            self.ts = stage.result
+
+    def read(self):
+        read_kwargs = {}
+        if not self.read_all:
+            read_kwargs["start_date"] = self.start_date
+        if self.use_cache:
+            try:
+                return cache.read(self.filename, **read_kwargs)
+            except OSError as e:
+                logging.getLogger("haggregate").warning(
+                    "Not using the cache of {}: {}".format(self.filename, str(e))
+                )
+        with open(self.filename, newline="\n") as f:
+            return HTimeseries(
+                f,
+                format=HTimeseries.FILE,
+                default_tzinfo=dt.timezone.utc,
+                **read_kwargs,
+            )
+
+
+class _TargetTail:
+    """Location of the data and of the last record in an existing target file."""
+
+    def __init__(self, data_start, last_line_start, last_timestamp, count):
+        self.data_start = data_start
+        self.last_line_start = last_line_start
+        self.last_timestamp = last_timestamp
+        self.count = count
+
+
+def _read_target_tail(target_filename):
+    """Return a _TargetTail for the target file, or None if it has no records.
+
+    Normally only the header and the last line of the file are read.
+    """
+    if not os.path.exists(target_filename):
+        return None
+    count = None
+    with open(target_filename, "rb") as f:
+        for line in f:
+            if not line.strip():
+                break
+            m = re.match(rb"Count\s*=\s*(\d+)", line)
+            if m:
+                count = int(m.group(1))
+        else:
+            return None
+        data_start = f.tell()
+        last_line_start, last_line = _read_last_line(f, data_start)
+        if last_line_start is None:
+            return None
+        if count is None:
+            f.seek(data_start)
+            count = sum(1 for line in f if line.strip())
+    last_timestamp = pd.Timestamp(last_line.decode().split(",")[0])
+    return _TargetTail(data_start, last_line_start, last_timestamp, count)
+
+
+def _read_last_line(f, data_start):
+    """Return the position and content of the last nonblank line after data_start."""
+    pos = f.seek(0, os.SEEK_END)
+    block = b""
+    while pos > data_start:
+        size = min(4096, pos - data_start)
+        pos -= size
+        f.seek(pos)
+        block = f.read(size) + block
+        stripped = block.rstrip()
+        line_start = stripped.rfind(b"\n") + 1
+        if line_start > 0:
+            return pos + line_start, stripped[line_start:]
+    stripped = block.rstrip()
+    return (data_start, stripped) if stripped else (None, None)
+
+
+def _append_to_target(aggts, target_filename, target_tail):
+    """Replace the last record of the target file with the new records.
+
+    The records before the last one are copied as they are, without parsing them;
+    only the header is recreated, as the count of records changes. aggts must have
+    a record at the last timestamp of the target (see _starts_at_last_record()).
+    """
+    last_timestamp = target_tail.last_timestamp.tz_localize(aggts.data.index.tz)
+    new_data = aggts.data[aggts.data.index >= last_timestamp]
+    aggts.data = new_data
+    records = StringIO()
+    aggts.write(records, format=HTimeseries.TEXT)
+    records = records.getvalue()
+    header = StringIO()
+    aggts.write(header, format=HTimeseries.FILE)
+    header = header.getvalue()[: -len(records)]
+    count = target_tail.count - 1 + len(new_data)
+    header = re.sub(r"^Count=\d+", "Count={}".format(count), header, flags=re.M)
+
+    dirname = os.path.dirname(os.path.abspath(target_filename))
+    with open(target_filename, "rb") as old, tempfile.NamedTemporaryFile(
+        "wb", dir=dirname, delete=False
+    ) as new:
+        new.write(header.encode())
+        old.seek(target_tail.data_start)
+        _copy_bytes(old, new, target_tail.last_line_start - target_tail.data_start)
+        new.write(records.encode())
+    shutil.copymode(target_filename, new.name)
+    os.replace(new.name, target_filename)
+
+
+def _copy_bytes(source, target, size):
+    while size > 0:
+        chunk = source.read(min(size, 1024 * 1024))
+        if not chunk:
+            break
+        target.write(chunk)
+        size -= len(chunk)
+
+
+def _process_sequentially(sources):
+    return [name for sections in sources for name in process_source(sections)]
+
+
+def _process_in_parallel(sources, workers):
+    """Process the sources in a pool of processes.
+
+    The workers send their log records to the main process through a queue, so that
+    they end up in the configured handlers (such as the log file).
+    """
+    logger = logging.getLogger("haggregate")
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *logger.handlers, respect_handler_level=True
+    )
+    listener.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(sources)),
+            initializer=_initialize_worker,
+            initargs=(log_queue, logger.level),
+        ) as executor:
+            futures = [executor.submit(process_source, s) for s in sources]
+            failed = []
+            for sections, future in zip(sources, futures):
+                try:
+                    failed.extend(future.result())
+                except Exception as e:
+                    # The worker process itself failed
+                    for section in sections:
+                        _log_failure(section["section_name"], e)
+                        failed.append(section["section_name"])
+    finally:
+        listener.stop()
+    return failed
+
+
+def _process_pipelined(sources, depth):
+    """Process the sources, overlapping the file input and output with computation.
+
+    While the sections of a source are being processed, up to "depth" of the next
+    sources are read in advance, and up to "depth" finished targets wait to be
+    written, in other threads.
+    """
+    return asyncio.run(_run_pipeline(sources, depth))
+
+
+async def _run_pipeline(sources, depth):
+    loop = asyncio.get_running_loop()
+    read_queue = asyncio.Queue(depth)
+    write_queue = asyncio.Queue(depth)
+
+    def write_later(*args):
+        # Called in the computing thread, which waits while the queue is full
+        asyncio.run_coroutine_threadsafe(write_queue.put(args), loop).result()
+
+    # One thread each for reading, computing and writing
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        reader = loop.create_task(_read_sources(sources, read_queue, executor))
+        writer = loop.create_task(_write_targets(write_queue, executor))
+        failed = []
+        for _ in sources:
+            sections, source = await read_queue.get()
+            if isinstance(source, Exception):
+                raise source
+            failed += await loop.run_in_executor(
+                executor, _process_sections, sections, source, write_later
+            )
+        await reader
+        await write_queue.put(None)
+        failed += await writer
+    return failed
+
+
+async def _read_sources(sources, read_queue, executor):
+    loop = asyncio.get_running_loop()
+    for sections in sources:
+        try:
+            source = await loop.run_in_executor(executor, _prepare_source, sections)
+        except Exception as e:
+            await read_queue.put((sections, e))  # process_source() would also raise
+            return
+        try:
+            await loop.run_in_executor(executor, source.load)
+        except Exception:
+            pass  # The sections will fail when processed, and the error will be logged
+        await read_queue.put((sections, source))
+
+
+async def _write_targets(write_queue, executor):
+    loop = asyncio.get_running_loop()
+    failed = []
+    while True:
+        item = await write_queue.get()
+        if item is None:
+            return failed
+        section_name, *args = item
+        try:
+            await loop.run_in_executor(executor, _write_target, *args)
+        except Exception as e:
+            _log_failure(section_name, e)
+            failed.append(section_name)
+
+
+def _initialize_worker(log_queue, loglevel):
+    logger = logging.getLogger("haggregate")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(loglevel)
+
+
+def _log_failure(section_name, e):
+    logger = logging.getLogger("haggregate")
+    logger.error("{}: {}".format(section_name, str(e)))
+    logger.debug("".join(traceback.format_exception(type(e), e, e.__traceback__)))
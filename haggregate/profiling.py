@@ -0,0 +1,156 @@
+"""Optional measurement of the time and memory used by each processing stage.
+
+Processing is measured only while a profile is active in the current thread;
+otherwise stage() does nothing. For example:
+
+    with profile("temperature") as p:
+        with stage("read") as s:
+            s.result = read_timeseries()
+    print(p.format())
+
+The peak resident memory is that since the start of the profile, if the peak can
+be reset (on Linux); otherwise it is the peak of the process since it started,
+which only grows and cannot tell which time series need the most memory.
+"""
+
+import contextlib
+import datetime as dt
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+_active = threading.local()  # The "profile" attribute is the active profile
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.result = None
+        self.time = None
+        self.records = None
+        self.peak_rss = None
+
+    def finish(self, time):
+        self.time = time
+        self.peak_rss = get_peak_rss()
+        if self.result is not None:
+            self.records = len(getattr(self.result, "data", self.result))
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "time": self.time,
+            "records": self.records,
+            "peak_rss": self.peak_rss,
+        }
+
+
+class Profile:
+    def __init__(self, name):
+        self.name = name
+        self.start = dt.datetime.now(dt.timezone.utc)
+        self.time = None
+        self.stages = []
+        self.peak_rss = None
+        self.peak_rss_scope = "profile" if reset_peak_rss() else "process"
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "start": self.start.isoformat(),
+            "time": self.time,
+            "peak_rss": self.peak_rss,
+            "peak_rss_scope": self.peak_rss_scope,
+            "stages": [s.as_dict() for s in self.stages],
+        }
+
+    def format(self):
+        stages = []
+        for s in self.stages:
+            records = "" if s.records is None else ", {} records".format(s.records)
+            stages.append("{} {:.3f} s{}".format(s.name, s.time, records))
+        peak_rss = self.peak_rss
+        peak_rss = "unknown" if peak_rss is None else "{:.1f} MB".format(peak_rss / 1e6)
+        scope = "peak RSS" if self.peak_rss_scope == "profile" else "process peak RSS"
+        return "{}: {:.3f} s ({}); {} {}".format(
+            self.name, self.time, "; ".join(stages), scope, peak_rss
+        )
+
+    def write(self, filename):
+        """Append the profile to a JSON lines file."""
+        with open(filename, "a") as f:
+            f.write(json.dumps(self.as_dict()) + "\n")
+
+
+@contextlib.contextmanager
+def profile(name):
+    """Activate a profile; the stages executed in the block are recorded in it."""
+    result = Profile(name)
+    previous_profile = getattr(_active, "profile", None)
+    _active.profile = result
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.time = time.perf_counter() - start
+        result.peak_rss = get_peak_rss()
+        _active.profile = previous_profile
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Record a stage in the active profile, if any.
+
+    The caller may set the "result" attribute of the yielded object to the time
+    series (or array) produced by the stage, and its number of records will be
+    recorded.
+    """
+    result = Stage(name)
+    active_profile = getattr(_active, "profile", None)
+    if active_profile is None:
+        yield result
+        return
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.finish(time.perf_counter() - start)
+        active_profile.stages.append(result)
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size to the current one; return whether done.
+
+    This is possible only on Linux, where get_peak_rss() then returns the peak
+    since the reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss():
+    """Return the peak resident set size in bytes (None if unknown).
+
+    It is the peak since the last reset_peak_rss(), if that succeeded.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
@@ -0,0 +1,323 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from htimeseries import HTimeseries
+from pandas.tseries.frequencies import to_offset
+
+from .haggregate import RegularizationMode as RM
+from .haggregate import _expand, _valid_positions
+
+try:
+    from ._regularize import _perform_regularization as _perform_regularization_cython
+except ImportError:  # The extension has not been compiled
+    _perform_regularization_cython = None
+
+
+class RegularizeError(Exception):
+    pass
+
+
+def regularize(ts, new_date_flag="DATEINSERT", mode=RM.INTERVAL, backend=None):
+    # Sanity checks
+    if not hasattr(ts, "time_step"):
+        raise RegularizeError("The source time series does not specify a time step")
+    _get_step(ts.time_step)
+    _get_backend(backend)
+
+    # Set metadata of result
+    result = HTimeseries()
+    attrs = (
+        "unit",
+        "timezone",
+        "time_step",
+        "interval_type",
+        "variable",
+        "precision",
+        "location",
+    )
+    for attr in attrs:
+        setattr(result, attr, getattr(ts, attr, None))
+    if hasattr(ts, "title"):
+        result.title = "Regularized " + ts.title
+    if hasattr(ts, "comment"):
+        result.comment = (
+            "Created by regularizing step of timeseries that had this comment:\n\n"
+            + ts.comment
+        )
+
+    # Return immediately if empty
+    if len(ts.data) == 0:
+        return result
+
+    tz = ts.data.index.tz
+    result_index, result_values, result_flags = regularize_arrays(
+        ts.data.index.asi8,
+        ts.data["value"].to_numpy(dtype=np.float64),
+        ts.data["flags"],
+        ts.time_step,
+        mode=mode,
+        new_date_flag=new_date_flag,
+        backend=backend,
+        tz=tz,
+    )
+    index = pd.DatetimeIndex(result_index.view("datetime64[ns]"))
+    result.data = pd.DataFrame(
+        {"value": result_values, "flags": result_flags},
+        index=index.tz_localize(dt.timezone.utc).tz_convert(tz),
+    )
+    return result
+
+
+def regularize_arrays(
+    index_ns,
+    values,
+    flags,
+    time_step,
+    mode=RM.INTERVAL,
+    new_date_flag="DATEINSERT",
+    backend=None,
+    tz=None,
+):
+    """Regularize a time series given as arrays, without creating pandas objects.
+
+    index_ns are the sorted timestamps as int64 nanoseconds since the epoch, values
+    are float64, and flags is an array of strings, a pd.Categorical, or None. The
+    arrays (which may be memory-mapped) are used as they are, without copying, if
+    they already have these dtypes. The first and last timestamps of the result are
+    the rounded first and last source timestamps, where the rounding is done in the
+    time zone tz (UTC if None). Returns a tuple (index_ns, values, flags), where
+    flags is a pd.Categorical.
+
+    values may also be a 2-D array with a column for each of many time series that
+    have the same timestamps, and flags a 2-D array of strings or None; all columns
+    are then regularized at once, with NumPy regardless of the backend, and the
+    returned flags is a list with a pd.Categorical for each column.
+    """
+    step = _get_step(time_step)
+    perform_regularization = _get_backend(backend)
+    ts_index = np.asarray(index_ns, dtype=np.int64)
+    ts_values = np.asarray(values, dtype=np.float64)
+    if flags is None:
+        flags = pd.Categorical.from_codes(
+            np.zeros(len(ts_index), dtype=np.int8), categories=[""]
+        )
+    elif ts_values.ndim == 2:
+        flags = np.asarray(flags, dtype=object)
+    if ts_values.ndim == 2:
+        return _regularize_columns(
+            ts_index, ts_values, flags, step, mode, new_date_flag, tz
+        )
+    if len(ts_index) == 0:
+        sources = np.empty(0, dtype=np.int64)
+        inserted = np.empty(0, dtype=bool)
+        result_flags = _get_result_flags(flags, sources, inserted, new_date_flag)
+        return ts_index, np.empty(0), result_flags
+
+    result_index = _get_result_index(ts_index, step, tz)
+    result_values = np.empty(len(result_index), dtype=np.float64)
+    result_sources = np.empty(len(result_index), dtype=np.int64)
+    result_inserted = np.empty(len(result_index), dtype=np.uint8)
+
+    # Do the job
+    perform_regularization(
+        result_index,
+        result_values,
+        result_sources,
+        result_inserted,
+        ts_index,
+        ts_values,
+        step.value,
+        mode.value,
+    )
+    result_flags = _get_result_flags(
+        flags, result_sources, result_inserted.view(bool), new_date_flag
+    )
+    return result_index, result_values, result_flags
+
+
+def regularize_frame(data, time_step, flags=None, **kwargs):
+    """Regularize many time series that have the same timestamps at once.
+
+    data is a DataFrame with a DatetimeIndex and a column of values for each time
+    series, and flags None or a DataFrame of strings with the same shape. The other
+    arguments are as in regularize_arrays(). Returns a tuple (values, flags) of
+    DataFrames with the same columns as data.
+    """
+    tz = data.index.tz
+    result_index, result_values, result_flags = regularize_arrays(
+        data.index.asi8,
+        data.to_numpy(dtype=np.float64),
+        None if flags is None else flags.to_numpy(dtype=object),
+        time_step,
+        tz=tz,
+        **kwargs,
+    )
+    index = pd.DatetimeIndex(result_index.view("datetime64[ns]"), name=data.index.name)
+    index = index.tz_localize(dt.timezone.utc).tz_convert(tz)
+    values = pd.DataFrame(result_values, index=index, columns=data.columns)
+    flags = pd.DataFrame(dict(enumerate(result_flags)), index=index)
+    flags.columns = data.columns
+    return values, flags
+
+
+def _regularize_columns(ts_index, ts_values, flags, step, mode, new_date_flag, tz):
+    if len(ts_index) == 0:
+        result_index = ts_index
+    else:
+        result_index = _get_result_index(ts_index, step, tz)
+    sources, inserted = _find_sources(
+        result_index, ts_index, ts_values, step.value, mode.value
+    )
+    shape = (len(result_index), ts_values.shape[1])
+    sources = np.broadcast_to(_expand(sources, 2), shape)
+    inserted = np.broadcast_to(_expand(inserted, 2), shape)
+    # A source of -1 (no source record) selects the appended row of NaNs
+    padded_values = np.concatenate((ts_values, np.full((1, shape[1]), np.nan)))
+    result_values = np.take_along_axis(padded_values, sources, axis=0)
+    result_flags = _get_result_flags(flags, sources, inserted, new_date_flag)
+    return result_index, result_values, result_flags
+
+
+def _get_result_index(ts_index, step, tz):
+    """Return the result timestamps, from the rounded first to the rounded last."""
+    first, last = pd.to_datetime(ts_index[[0, -1]], utc=True).tz_convert(tz).round(step)
+    # Integer arithmetic; np.arange with a float length would lose the last one
+    count = (last.value - first.value) // step.value + 1
+    return first.value + step.value * np.arange(count, dtype=np.int64)
+
+
+def _get_step(time_step):
+    try:
+        return pd.to_timedelta(to_offset(time_step))
+    except ValueError:
+        raise RegularizeError(
+            "The time step is malformed or is specified in months. Only time steps "
+            "specified in minutes, hours or days are supported."
+        )
+
+
+def _get_backend(backend):
+    if backend is None:
+        backend = "cython" if _perform_regularization_cython else "numpy"
+    if backend == "cython":
+        if not _perform_regularization_cython:
+            raise RegularizeError(
+                "The cython backend is not available because the haggregate._regularize"
+                " extension has not been compiled"
+            )
+        return _perform_regularization_cython
+    elif backend == "numpy":
+        return _perform_regularization_numpy
+    raise RegularizeError('Unknown regularization backend "{}"'.format(backend))
+
+
+def _get_result_flags(ts_flags, result_sources, result_inserted, new_date_flag):
+    """Create the flags of the result from the indices calculated by the kernel.
+
+    Each result record has the flags of the source record it was taken from (if any),
+    plus new_date_flag if its timestamp was changed. The result is a
+    pd.Categorical; the strings are only processed once for each distinct value.
+    If result_sources and result_inserted are 2-D, with a column for each time
+    series, a list with a pd.Categorical for each column is returned; ts_flags is
+    then 2-D as well, or 1-D if all time series have the same flags.
+    """
+    if np.ndim(ts_flags) == 2:
+        source_codes, source_categories = pd.factorize(ts_flags.ravel())
+        source_codes = source_codes.reshape(ts_flags.shape)
+    else:
+        source_codes, source_categories = pd.factorize(ts_flags)
+    # One more category for records without flags or without a source record
+    categories = np.append(np.asarray(source_categories, dtype=str), "")
+    empty_code = len(categories) - 1
+    source_codes = np.where(source_codes >= 0, source_codes, empty_code)
+    # A result_sources of -1 (no source record) selects the appended empty_code
+    if source_codes.ndim == 2:
+        empty_row = np.full((1, source_codes.shape[1]), empty_code)
+        source_codes = np.concatenate((source_codes, empty_row))
+        codes = np.take_along_axis(source_codes, result_sources, axis=0)
+    else:
+        codes = np.append(source_codes, empty_code)[result_sources]
+    if new_date_flag:
+        inserted_categories = np.where(
+            categories == "",
+            new_date_flag,
+            np.char.add(categories, " " + new_date_flag),
+        )
+        categories = np.concatenate((categories, inserted_categories))
+        codes = np.where(result_inserted, codes + empty_code + 1, codes)
+    # Categories may be repeated, e.g. "DATEINSERT" both in the source and inserted
+    category_codes, unique_categories = pd.factorize(categories)
+    codes = category_codes[codes]
+    if codes.ndim == 2:
+        return [
+            pd.Categorical.from_codes(column, categories=unique_categories)
+            for column in codes.T
+        ]
+    # Drop the unused categories without remove_unused_categories(), which would
+    # find the unique codes again
+    used = np.bincount(codes, minlength=len(unique_categories)) > 0
+    codes = (np.cumsum(used) - 1)[codes]
+    return pd.Categorical.from_codes(codes, categories=unique_categories[used])
+
+
+def _perform_regularization_numpy(
+    result_index,
+    result_values,
+    result_sources,
+    result_inserted,
+    ts_index,
+    ts_values,
+    result_step,
+    mode,
+):
+    """Vectorized equivalent of the kernel in haggregate._regularize.
+
+    It finds the candidate source records for all result timestamps at once with
+    np.searchsorted, and is used when the extension has not been compiled.
+    """
+    sources, inserted = _find_sources(
+        result_index, ts_index, ts_values, result_step, mode
+    )
+    result_sources[:] = sources
+    result_inserted[:] = inserted
+    result_values[:] = np.append(ts_values, np.nan)[sources]  # -1 gives the NaN
+
+
+def _find_sources(result_index, ts_index, ts_values, result_step, mode):
+    """Return the source record of each result timestamp, and whether it's moved.
+
+    The source is -1 if there's none. ts_values may be 2-D, with a column for each
+    time series; in INSTANTANEOUS mode, where the sources depend on which values are
+    null, the results are then 2-D as well.
+    """
+    half_step = result_step // 2
+    window_start = np.searchsorted(ts_index, result_index - half_step)
+    window_end = np.searchsorted(ts_index, result_index + result_step - half_step)
+    pos = np.searchsorted(ts_index, result_index)  # First record at or after t
+
+    # Sentinel at the end so that pos (and the other indices) can equal len(ts_index)
+    ts_index = np.append(ts_index, np.iinfo(np.int64).max)
+
+    if mode == RM.INTERVAL.value:
+        exact = ts_index[pos] == result_index
+        single = window_end - window_start == 1
+        sources = np.where(exact, pos, np.where(single, window_start, -1))
+        return sources, single & ~exact
+
+    # With 2-D values, the 1-D arrays below get a trailing axis to broadcast
+    ndim = ts_values.ndim
+    window_start, window_end, result_index = (
+        _expand(a, ndim) for a in (window_start, window_end, result_index)
+    )
+    previous_valid, next_valid = _valid_positions(ts_values)
+    left = previous_valid[pos]  # Last valid record before t
+    right = next_valid[pos]  # First valid record at or after t
+    has_left = left >= window_start
+    has_right = right < window_end
+    exact = has_right & (ts_index[right] == result_index)
+    right_is_nearer = has_right & (
+        ~has_left | (ts_index[right] - result_index < result_index - ts_index[left])
+    )
+    sources = np.where(right_is_nearer, right, np.where(has_left, left, -1))
+    return sources, (sources >= 0) & ~exact
@@ -21,9 +21,9 @@ test_requirements = []
 def use_cython():
     base_dir = os.path.dirname(os.path.realpath(__file__))
 
-    regularize_pyx = os.path.join(base_dir, "haggregate", "regularize.pyx")
+    regularize_pyx = os.path.join(base_dir, "haggregate", "_regularize.pyx")
     regularize_pyx_exists = os.path.exists(regularize_pyx)
-    regularize_c = os.path.join(base_dir, "haggregate", "regularize.c")
+    regularize_c = os.path.join(base_dir, "haggregate", "_regularize.c")
     regularize_c_exists = os.path.exists(regularize_c)
 
     if (not regularize_pyx_exists) and (not regularize_c_exists):
@@ -43,9 +43,10 @@ if use_cython():
     # See https://github.com/cython/cython/issues/1480#issuecomment-401875701
     ext_modules = cythonize(
         Extension(
-            "haggregate.regularize",
-            sources=["haggregate/regularize.pyx"],
+            "haggregate._regularize",
+            sources=["haggregate/_regularize.pyx"],
             include_dirs=[numpy.get_include()],
+            optional=True,
         )
     )
 else:
@@ -53,9 +54,10 @@ else:
 
     ext_modules = [
         Extension(
-            "haggregate.regularize",
-            ["haggregate/regularize.c"],
+            "haggregate._regularize",
+            ["haggregate/_regularize.c"],
             include_dirs=[numpy.get_include()],
+            optional=True,
         )
     ]
 
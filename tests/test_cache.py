@@ -0,0 +1,89 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+import textwrap
+from unittest import TestCase
+from unittest.mock import patch
+
+import pandas as pd
+from htimeseries import HTimeseries
+
+from haggregate import cache
+
+timeseries_file = textwrap.dedent(
+    """\
+    Unit=mm
+    Timezone=+0200
+    Time_step=10min
+    Precision=2
+
+    2008-02-07 10:10,10.54,
+    2008-02-07 10:20,10.71,FLAG1
+    2008-02-07 10:30,,
+    2008-02-07 10:40,10.93,FLAG1 FLAG2
+    2008-02-07 10:50,11.10,
+    """
+)
+
+
+class CacheTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.filename = os.path.join(self.tempdir, "source.hts")
+        with open(self.filename, "w") as f:
+            f.write(timeseries_file)
+
+    def _read_text(self, **kwargs):
+        with open(self.filename, newline="\n") as f:
+            return HTimeseries(
+                f, format=HTimeseries.FILE, default_tzinfo=dt.timezone.utc, **kwargs
+            )
+
+    def _assert_same(self, ts, expected):
+        self.assertEqual(list(ts.data.index.asi8), list(expected.data.index.asi8))
+        self.assertEqual(
+            ts.data.index[0].utcoffset(), expected.data.index[0].utcoffset()
+        )
+        self.assertEqual(ts.data.index.name, expected.data.index.name)
+        pd.testing.assert_series_equal(
+            ts.data["value"].reset_index(drop=True),
+            expected.data["value"].reset_index(drop=True),
+        )
+        self.assertEqual(list(ts.data["flags"]), list(expected.data["flags"]))
+        for attr in ("unit", "time_step", "precision"):
+            self.assertEqual(getattr(ts, attr), getattr(expected, attr))
+
+    def test_creates_cache(self):
+        cache.read(self.filename)
+        self.assertEqual(
+            sorted(os.listdir(self.filename + ".cache")),
+            ["flag_codes.npy", "index.npy", "meta.json", "values.npy"],
+        )
+
+    def test_same_as_text(self):
+        cache.read(self.filename)
+        self._assert_same(cache.read(self.filename), self._read_text())
+
+    def test_start_date(self):
+        start_date = dt.datetime(2008, 2, 7, 10, 30)
+        cache.read(self.filename)
+        self._assert_same(
+            cache.read(self.filename, start_date=start_date),
+            self._read_text(start_date=start_date),
+        )
+
+    def test_uses_cache(self):
+        cache.read(self.filename)
+        with patch("haggregate.cache._create") as mock_create:
+            cache.read(self.filename)
+        mock_create.assert_not_called()
+
+    def test_recreates_cache_when_file_changes(self):
+        cache.read(self.filename)
+        with open(self.filename, "a") as f:
+            f.write("2008-02-07 11:00,11.23,\n")
+        ts = cache.read(self.filename)
+        self.assertEqual(len(ts.data), 6)
+        self._assert_same(ts, self._read_text())
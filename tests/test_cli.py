@@ -1,9 +1,16 @@
 import datetime as dt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import textwrap
 from unittest import TestCase
 from unittest.mock import patch
 
 from click.testing import CliRunner
+from htimeseries import HTimeseries
 
 from haggregate import RegularizationMode, cli
 
@@ -20,6 +27,22 @@ class CliUsageErrorTestCase(TestCase):
         self.assertIn("Usage: main [OPTIONS] CONFIGFILE", self.result.output)
 
 
+class CliStartupTestCase(TestCase):
+    def test_pandas_is_not_imported(self):
+        # It is imported only when there is work to do, as it is slow to import
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, haggregate.cli; print('pandas' in sys.modules)",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.strip(), "False")
+
+
 class CliConfigFileNotFoundTestCase(TestCase):
     def setUp(self):
         runner = CliRunner()
@@ -57,9 +80,9 @@ class CliNoTimeSeriesErrorTestCase(TestCase):
 
 
 class CliMixin:
-    @patch("haggregate.cli.HTimeseries", **{"return_value": "my timeseries"})
-    @patch("haggregate.cli.regularize", return_value="regularized timeseries")
-    @patch("haggregate.cli.aggregate")
+    @patch("haggregate.processing.HTimeseries", **{"return_value": "my timeseries"})
+    @patch("haggregate.processing.regularize", return_value="regularized timeseries")
+    @patch("haggregate.processing.aggregate")
     def _execute(self, mock_aggregate, mock_regularize, mock_htimeseries):
         self.mock_aggregate = mock_aggregate
         self.mock_regularize = mock_regularize
@@ -118,6 +141,7 @@ class CliTestCase(CliMixin, TestCase):
             min_count=10,
             missing_flag="MISSING",
             target_timestamp_offset=None,
+            target_timezone=None,
         )
 
     def test_wrote_target_file(self):
@@ -174,6 +198,53 @@ class RegularizationModeTestCase(CliMixin, TestCase):
         )
 
 
+class CliSharedSourceTestCase(CliMixin, TestCase):
+    configuration = textwrap.dedent(
+        """\
+        [General]
+        target_step = 1H
+        min_count = 3
+        missing_flag = MISSING
+
+        [Mean]
+        source_file = mytimeseries.hts
+        target_file = mean.hts
+        method = mean
+
+        [Max]
+        source_file = mytimeseries.hts
+        target_file = max.hts
+        method = max
+
+        [Min]
+        source_file = mytimeseries.hts
+        target_file = min.hts
+        method = min
+        """
+    )
+
+    def setUp(self):
+        self._execute()
+
+    def test_exit_code(self):
+        self.assertEqual(self.result.exit_code, 0)
+
+    def test_read_source_file_once(self):
+        self.assertEqual(self.mock_htimeseries.call_count, 1)
+
+    def test_regularized_once_per_mode(self):
+        self.assertEqual(
+            [c.kwargs["mode"] for c in self.mock_regularize.call_args_list],
+            [RegularizationMode.INSTANTANEOUS, RegularizationMode.INTERVAL],
+        )
+
+    def test_aggregated_for_each_section(self):
+        self.assertEqual(
+            [c.args[2] for c in self.mock_aggregate.call_args_list],
+            ["mean", "max", "min"],
+        )
+
+
 class CliWithTargetTimestampOffsetTestCase(CliMixin, TestCase):
     configuration = textwrap.dedent(
         """\
@@ -214,7 +285,518 @@ class CliWithTargetTimestampOffsetTestCase(CliMixin, TestCase):
             min_count=10,
             missing_flag="MISSING",
             target_timestamp_offset="1min",
+            target_timezone=None,
         )
 
     def test_wrote_target_file(self):
         self.assertEqual(self.mock_aggregate.return_value.write.call_count, 1)
+
+
+tenmin_timeseries_file = textwrap.dedent(
+    """\
+    Unit=mm
+    Timezone=+0200
+    Time_step=10min
+    Precision=2
+
+    2008-02-07 10:10,10.54,
+    2008-02-07 10:20,10.71,
+    2008-02-07 10:30,10.96,
+    2008-02-07 10:40,10.93,
+    2008-02-07 10:50,11.10,
+    2008-02-07 11:00,11.23,
+    2008-02-07 11:10,11.44,
+    2008-02-07 11:20,11.41,
+    """
+)
+
+
+class CliRealFilesMixin:
+    """Run the cli on real files (needed when sections run in other processes)."""
+
+    configuration_general = textwrap.dedent(
+        """\
+        [General]
+        base_dir = {base_dir}
+        logfile = {base_dir}/haggregate.log
+        target_step = 1H
+        min_count = 2
+        missing_flag = MISS
+        """
+    )
+    configuration_sections = ""
+    args = []
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        with open(os.path.join(self.tempdir, "source.hts"), "w") as f:
+            f.write(tenmin_timeseries_file)
+        self.configfile = os.path.join(self.tempdir, "config.ini")
+        with open(self.configfile, "w") as f:
+            f.write(self.configuration_general.format(base_dir=self.tempdir))
+            f.write(self.configuration_sections)
+        self.result = CliRunner().invoke(cli.main, self.args + [self.configfile])
+
+    def _read_target(self, filename):
+        with open(os.path.join(self.tempdir, filename), newline="\n") as f:
+            return HTimeseries(f, format=HTimeseries.FILE)
+
+    def _read_log(self):
+        with open(os.path.join(self.tempdir, "haggregate.log")) as f:
+            return f.read()
+
+
+class CliParallelTestCase(CliRealFilesMixin, TestCase):
+    configuration_sections = textwrap.dedent(
+        """\
+        [sum]
+        source_file = source.hts
+        target_file = sum.hts
+        method = sum
+
+        [nonexistent]
+        source_file = nonexistent.hts
+        target_file = nonexistent-sum.hts
+        method = sum
+
+        [max]
+        source_file = source.hts
+        target_file = max.hts
+        method = max
+        """
+    )
+    args = ["--jobs", "2"]
+
+    def test_exit_code(self):
+        self.assertTrue(self.result.exit_code > 0)
+
+    def test_error_message(self):
+        self.assertIn("1 of 3 time series failed", self.result.output)
+
+    def test_failure_is_logged(self):
+        self.assertIn("nonexistent: [Errno 2] No such file", self._read_log())
+
+    def test_sum(self):
+        data = self._read_target("sum.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 65.47)
+
+    def test_max(self):
+        data = self._read_target("max.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 11.23)
+
+
+class CliWorkersTestCase(CliRealFilesMixin, TestCase):
+    configuration_general = CliRealFilesMixin.configuration_general + "workers = 2\n"
+    configuration_sections = textwrap.dedent(
+        """\
+        [sum]
+        source_file = source.hts
+        target_file = sum.hts
+        method = sum
+        """
+    )
+
+    def test_exit_code(self):
+        self.assertEqual(self.result.exit_code, 0)
+
+    def test_sum(self):
+        data = self._read_target("sum.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 65.47)
+
+
+class CliZeroJobsTestCase(CliRealFilesMixin, TestCase):
+    configuration_sections = CliWorkersTestCase.configuration_sections
+    args = ["--jobs", "0"]
+
+    def test_exit_code(self):
+        self.assertTrue(self.result.exit_code > 0)
+
+    def test_error_message(self):
+        self.assertIn("The number of workers must be at least 1", self.result.output)
+
+
+class CliContinuesAfterFailureTestCase(CliRealFilesMixin, TestCase):
+    configuration_sections = CliParallelTestCase.configuration_sections
+
+    def test_exit_code(self):
+        self.assertTrue(self.result.exit_code > 0)
+
+    def test_error_message(self):
+        self.assertIn("1 of 3 time series failed", self.result.output)
+
+    def test_max(self):
+        data = self._read_target("max.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 11.23)
+
+
+class CliPipelineTestCase(CliRealFilesMixin, TestCase):
+    configuration_general = CliRealFilesMixin.configuration_general + "pipeline = 1\n"
+    configuration_sections = CliParallelTestCase.configuration_sections + (
+        "\n[unwritable]\n"
+        "source_file = source.hts\n"
+        "target_file = nonexistent/min.hts\n"
+        "method = min\n"
+    )
+
+    def test_exit_code(self):
+        self.assertTrue(self.result.exit_code > 0)
+
+    def test_error_message(self):
+        self.assertIn("2 of 4 time series failed", self.result.output)
+
+    def test_failures_are_logged(self):
+        log = self._read_log()
+        self.assertIn("nonexistent: [Errno 2] No such file", log)
+        self.assertIn("unwritable: [Errno 2] No such file", log)
+
+    def test_sum(self):
+        data = self._read_target("sum.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 65.47)
+
+    def test_max(self):
+        data = self._read_target("max.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 11.23)
+
+
+class CliSectionTargetStepTestCase(CliRealFilesMixin, TestCase):
+    configuration_sections = textwrap.dedent(
+        """\
+        [hourly]
+        source_file = source.hts
+        target_file = hourly.hts
+        method = sum
+
+        [halfhourly]
+        source_file = source.hts
+        target_file = halfhourly.hts
+        method = sum
+        target_step = 30min
+        min_count = 1
+        """
+    )
+
+    def test_exit_code(self):
+        self.assertEqual(self.result.exit_code, 0)
+
+    def test_hourly(self):
+        data = self._read_target("hourly.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 65.47)
+
+    def test_halfhourly(self):
+        ts = self._read_target("halfhourly.hts")
+        self.assertEqual(ts.time_step, "30min")
+        self.assertEqual(len(ts.data), 3)
+        self.assertAlmostEqual(ts.data.loc["2008-02-07 11:00"].value, 33.26)
+        self.assertAlmostEqual(ts.data.loc["2008-02-07 11:30"].value, 22.85)
+        self.assertEqual(ts.data.loc["2008-02-07 11:30", "flags"], "MISS")
+
+
+class CliTargetTimezoneTestCase(CliRealFilesMixin, TestCase):
+    configuration_general = CliRealFilesMixin.configuration_general + (
+        "target_timezone = +0000\n"
+    )
+    configuration_sections = textwrap.dedent(
+        """\
+        [utc]
+        source_file = source.hts
+        target_file = utc.hts
+        method = sum
+
+        [cet]
+        source_file = source.hts
+        target_file = cet.hts
+        method = sum
+        target_timezone = +0100
+        """
+    )
+
+    def test_exit_code(self):
+        self.assertEqual(self.result.exit_code, 0)
+
+    def test_utc(self):
+        ts = self._read_target("utc.hts")
+        self.assertEqual(ts.data.index.tz.utcoffset(None), dt.timedelta(0))
+        self.assertAlmostEqual(ts.data.loc["2008-02-07 09:00"].value, 65.47)
+
+    def test_section_target_timezone(self):
+        ts = self._read_target("cet.hts")
+        self.assertEqual(ts.data.index.tz.utcoffset(None), dt.timedelta(hours=1))
+        self.assertAlmostEqual(ts.data.loc["2008-02-07 10:00"].value, 65.47)
+
+
+class CliProfileTestCase(CliRealFilesMixin, TestCase):
+    configuration_general = CliRealFilesMixin.configuration_general + (
+        "loglevel = INFO\nprofile = true\nstats_file = {base_dir}/stats.jsonl\n"
+    )
+    configuration_sections = textwrap.dedent(
+        """\
+        [sum]
+        source_file = source.hts
+        target_file = sum.hts
+        method = sum
+
+        [mean]
+        source_file = source.hts
+        target_file = mean.hts
+        method = mean
+        """
+    )
+
+    def _read_stats(self):
+        with open(os.path.join(self.tempdir, "stats.jsonl")) as f:
+            return [json.loads(line) for line in f]
+
+    def test_exit_code(self):
+        self.assertEqual(self.result.exit_code, 0)
+
+    def test_logged(self):
+        self.assertIn("Profile of sum: ", self._read_log())
+
+    def test_stats_file(self):
+        stats = self._read_stats()
+        self.assertEqual([s["name"] for s in stats], ["sum", "mean"])
+        self.assertEqual(
+            [s["stage"] for s in stats[0]["stages"]],
+            ["read", "regularize", "get_step", "aggregate", "flags", "trim", "write"],
+        )
+        self.assertEqual(stats[0]["stages"][0]["records"], 8)
+
+    def test_source_is_not_read_again(self):
+        stages = [s["stage"] for s in self._read_stats()[1]["stages"]]
+        self.assertEqual(stages[0], "regularize")
+
+
+class CliProfileEnvironmentVariableTestCase(CliRealFilesMixin, TestCase):
+    configuration_general = CliRealFilesMixin.configuration_general + (
+        "loglevel = INFO\n"
+    )
+    configuration_sections = CliWorkersTestCase.configuration_sections
+
+    def setUp(self):
+        with patch.dict(os.environ, {"HAGGREGATE_PROFILE": "1"}):
+            super().setUp()
+
+    def test_logged(self):
+        self.assertIn("Profile of sum: ", self._read_log())
+
+
+class CliCacheTestCase(CliRealFilesMixin, TestCase):
+    configuration_general = CliRealFilesMixin.configuration_general + "cache = true\n"
+    configuration_sections = CliWorkersTestCase.configuration_sections
+
+    def test_exit_code(self):
+        self.assertEqual(self.result.exit_code, 0)
+
+    def test_cache_created(self):
+        self.assertTrue(os.path.isdir(os.path.join(self.tempdir, "source.hts.cache")))
+
+    def test_sum_using_cache(self):
+        os.remove(os.path.join(self.tempdir, "sum.hts"))
+        result = CliRunner().invoke(cli.main, [self.configfile])
+        self.assertEqual(result.exit_code, 0)
+        data = self._read_target("sum.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 11:00"].value, 65.47)
+
+
+class CliSkipUnchangedTestCase(CliRealFilesMixin, TestCase):
+    configuration_general = (
+        CliRealFilesMixin.configuration_general
+        + "loglevel = info\nskip_unchanged = true\n"
+    )
+    configuration_sections = CliParallelTestCase.configuration_sections
+
+    def _run_again(self):
+        self.mtimes = {name: self._get_mtime(name) for name in ("sum.hts", "max.hts")}
+        return CliRunner().invoke(cli.main, [self.configfile])
+
+    def _get_mtime(self, filename):
+        return os.stat(os.path.join(self.tempdir, filename)).st_mtime_ns
+
+    def _was_rewritten(self, filename):
+        return self._get_mtime(filename) != self.mtimes[filename]
+
+    def test_manifest_created(self):
+        filename = os.path.join(self.tempdir, "haggregate-manifest.json")
+        with open(filename) as f:
+            manifest = json.load(f)
+        self.assertEqual(len(manifest), 2)  # The failed section isn't recorded
+
+    def test_unchanged_sections_are_skipped(self):
+        result = self._run_again()
+        self.assertIn("1 of 3 time series failed", result.output)
+        self.assertFalse(self._was_rewritten("sum.hts"))
+        self.assertFalse(self._was_rewritten("max.hts"))
+        self.assertIn("Skipping 2 unchanged time series", self._read_log())
+
+    def test_changed_source(self):
+        source_filename = os.path.join(self.tempdir, "source.hts")
+        with open(source_filename, "a") as f:
+            f.write("2008-02-07 11:30,11.60,\n")
+        self._run_again()
+        self.assertTrue(self._was_rewritten("sum.hts"))
+        data = self._read_target("sum.hts").data
+        self.assertAlmostEqual(data.loc["2008-02-07 12:00"].value, 34.45)
+
+    def test_changed_parameters(self):
+        with open(self.configfile) as f:
+            configuration = f.read()
+        with open(self.configfile, "w") as f:
+            f.write(configuration.replace("method = max", "method = min"))
+        self._run_again()
+        self.assertFalse(self._was_rewritten("sum.hts"))
+        self.assertTrue(self._was_rewritten("max.hts"))
+
+    def test_invalid_manifest(self):
+        filename = os.path.join(self.tempdir, "haggregate-manifest.json")
+        with open(filename) as f:
+            content = f.read()
+        with open(filename, "w") as f:
+            f.write(content[: len(content) // 2])
+        result = self._run_again()
+        self.assertIn("1 of 3 time series failed", result.output)
+        self.assertTrue(self._was_rewritten("sum.hts"))
+        self.assertTrue(self._was_rewritten("max.hts"))
+        self.assertIn("Ignoring invalid manifest", self._read_log())
+        with open(filename) as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+    def test_modified_target(self):
+        with open(os.path.join(self.tempdir, "sum.hts"), "a") as f:
+            f.write("\n")
+        self._run_again()
+        self.assertTrue(self._was_rewritten("sum.hts"))
+        self.assertFalse(self._was_rewritten("max.hts"))
+
+
+class CliIncrementalTestCase(TestCase):
+    configuration = textwrap.dedent(
+        """\
+        [General]
+        base_dir = {base_dir}
+        target_step = 1H
+        min_count = 2
+        missing_flag = MISS
+        target_timestamp_offset = 1min
+        incremental = {incremental}
+
+        [sum]
+        source_file = source.hts
+        target_file = sum.hts
+        method = sum
+        """
+    )
+    new_source_records = textwrap.dedent(
+        """\
+        2008-02-07 11:30,11.42,
+        2008-02-07 11:40,11.54,
+        2008-02-07 11:50,11.68,
+        2008-02-07 12:00,11.80,
+        2008-02-07 12:10,11.91,
+        """
+    )
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        with open(self._path("source.hts"), "w") as f:
+            f.write(tenmin_timeseries_file)
+
+    def _path(self, filename):
+        return os.path.join(self.tempdir, filename)
+
+    def _run(self, incremental):
+        configfile = self._path("config.ini")
+        with open(configfile, "w") as f:
+            f.write(
+                self.configuration.format(
+                    base_dir=self.tempdir, incremental=incremental
+                )
+            )
+        result = CliRunner().invoke(cli.main, [configfile])
+        self.assertEqual(result.exit_code, 0)
+        with open(self._path("sum.hts"), newline="") as f:
+            return f.read()
+
+    def _add_source_records(self):
+        with open(self._path("source.hts"), "a") as f:
+            f.write(self.new_source_records)
+
+    def test_same_result_as_full_aggregation(self):
+        self._run(incremental="true")
+        self._add_source_records()
+        incremental_result = self._run(incremental="true")
+        os.remove(self._path("sum.hts"))
+        full_result = self._run(incremental="false")
+        self.assertEqual(incremental_result, full_result)
+
+    def test_last_record_is_recalculated(self):
+        first_result = self._run(incremental="true")
+        self.assertIn("2008-02-07 11:59,22.85,MISS\r\n", first_result)
+        self._add_source_records()
+        second_result = self._run(incremental="true")
+        self.assertIn("2008-02-07 11:59,69.29,\r\n", second_result)
+        self.assertIn("Count=2\r\n", second_result)
+
+    def test_previous_records_are_not_recalculated(self):
+        self._run(incremental="true")
+        with open(self._path("sum.hts"), newline="") as f:
+            content = f.read()
+        with open(self._path("sum.hts"), "w", newline="") as f:
+            f.write(content.replace("10:59,65.47,", "10:59,99.99,"))
+        self._add_source_records()
+        result = self._run(incremental="true")
+        self.assertIn("2008-02-07 10:59,99.99,\r\n", result)
+
+    def test_section_with_invalid_target_step(self):
+        self._run(incremental="true")
+        shutil.copy(self._path("sum.hts"), self._path("bad.hts"))
+        configfile = self._path("config.ini")
+        with open(configfile, "a") as f:
+            f.write(
+                "\n[bad]\nsource_file = source.hts\ntarget_file = bad.hts\n"
+                "method = sum\ntarget_step = 5X\n"
+            )
+        self._add_source_records()
+        result = CliRunner().invoke(cli.main, [configfile])
+        self.assertIn("1 of 2 time series failed", result.output)
+        with open(self._path("sum.hts"), newline="") as f:
+            self.assertIn(",69.29,\r\n", f.read())
+
+    def test_last_record_becomes_null(self):
+        self._run(incremental="true")
+        with open(self._path("source.hts")) as f:
+            content = f.read()
+        with open(self._path("source.hts"), "w") as f:
+            f.write(content.replace("11.44", "").replace("11.41", ""))
+            f.write("2008-02-07 12:10,11.91,\n2008-02-07 12:20,12.04,\n")
+        incremental_result = self._run(incremental="true")
+        os.remove(self._path("sum.hts"))
+        full_result = self._run(incremental="false")
+        self.assertEqual(incremental_result, full_result)
+
+
+class CliIncrementalWithTargetTimezoneTestCase(CliIncrementalTestCase):
+    # The target time zone is ahead of that of the source, so the source must be
+    # read from earlier than the last target timestamp, as a wall time, implies
+    configuration = CliIncrementalTestCase.configuration.replace(
+        "incremental =", "target_timezone = +0400\nincremental ="
+    )
+
+    def test_last_record_is_recalculated(self):
+        first_result = self._run(incremental="true")
+        self.assertIn("2008-02-07 13:59,22.85,MISS\r\n", first_result)
+        self._add_source_records()
+        second_result = self._run(incremental="true")
+        self.assertIn("2008-02-07 13:59,69.29,\r\n", second_result)
+        self.assertIn("Count=2\r\n", second_result)
+
+    def test_previous_records_are_not_recalculated(self):
+        self._run(incremental="true")
+        with open(self._path("sum.hts"), newline="") as f:
+            content = f.read()
+        with open(self._path("sum.hts"), "w", newline="") as f:
+            f.write(content.replace("12:59,65.47,", "12:59,99.99,"))
+        self._add_source_records()
+        result = self._run(incremental="true")
+        self.assertIn("2008-02-07 12:59,99.99,\r\n", result)
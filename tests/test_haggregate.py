@@ -1,15 +1,31 @@
+import copy
+import datetime as dt
 import textwrap
 from io import StringIO
 from unittest import TestCase
+from unittest.mock import patch
 
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
     from backports.zoneinfo import ZoneInfo
 
+import numpy as np
+import pandas as pd
 from htimeseries import HTimeseries
-
-from haggregate import AggregateError, aggregate
+from htimeseries.timezone_utils import TzinfoFromString
+
+from haggregate import (
+    AggregatedTimeseries,
+    AggregateError,
+    CannotInferFrequency,
+    SourceTimeseries,
+    aggregate,
+    aggregate_arrays,
+    aggregate_frame,
+    aggregate_iter,
+)
+from haggregate.haggregate import _get_plan
 
 tenmin_test_timeseries = textwrap.dedent(
     """\
@@ -110,11 +126,59 @@ class TimestampIrregularityTestCase(TestCase):
             aggregate(ts, "1H", "sum")
 
 
+class GetStepTestCase(TestCase):
+    def _get_source(self, timestamps, time_step=None):
+        ts = HTimeseries()
+        if time_step:
+            ts.time_step = time_step
+        ts.data = pd.DataFrame(
+            {"value": 1.0, "flags": ""},
+            index=pd.DatetimeIndex(timestamps).tz_localize("Etc/GMT-2"),
+        )
+        return SourceTimeseries(ts)
+
+    def test_regular(self):
+        timestamps = pd.date_range("2008-02-07 10:10", periods=5, freq="10min")
+        step = self._get_source(timestamps).get_step()
+        self.assertEqual(step, pd.Timedelta("10min"))
+
+    def test_irregular_at_end(self):
+        timestamps = pd.date_range("2008-02-07", periods=200000, freq="10min")
+        timestamps = timestamps[:-1].append(pd.DatetimeIndex(["2020-01-01"]))
+        with self.assertRaises(AggregateError):
+            self._get_source(timestamps).get_step()
+
+    def test_too_few_records(self):
+        timestamps = pd.date_range("2008-02-07 10:10", periods=2, freq="10min")
+        with self.assertRaises(CannotInferFrequency):
+            self._get_source(timestamps).get_step()
+
+    def test_too_few_records_with_time_step(self):
+        timestamps = pd.date_range("2008-02-07 10:10", periods=1, freq="10min")
+        step = self._get_source(timestamps, time_step="10min").get_step()
+        self.assertEqual(step, pd.Timedelta("10min"))
+
+    def test_aggregate_two_records_with_time_step(self):
+        ts = HTimeseries(
+            StringIO("2008-02-07 10:50,1,\n2008-02-07 11:00,2,\n"),
+            default_tzinfo=ZoneInfo("Etc/GMT-2"),
+        )
+        ts.time_step = "10min"
+        result = aggregate(ts, "1H", "sum", min_count=1)
+        self.assertEqual(len(result.data), 1)
+        self.assertAlmostEqual(result.data.loc["2008-02-07 11:00"].value, 3)
+
+
 class WrongTimeStepTestCase(TestCase):
     def test_raises_exception(self):
-        msg = "The target step can currently only be 1H or 1D"
+        msg = "The target step must be a fixed step"
+        with self.assertRaisesRegex(AggregateError, msg):
+            aggregate(HTimeseries(), "1Y", "sum")
+
+    def test_zero_months(self):
+        msg = "The target step must be a fixed step"
         with self.assertRaisesRegex(AggregateError, msg):
-            aggregate(HTimeseries(), "5D", "sum")
+            aggregate(HTimeseries(), "0M", "sum")
 
 
 class HourlySumWithLargerMinCountTestCase(TestCase):
@@ -139,6 +203,89 @@ class HourlySumWithLargerMinCountTestCase(TestCase):
         self.assertAlmostEqual(self.result.data.loc["2008-02-07 13:00"].value, 72.77)
 
 
+class HourlySumWithEmptyMissingFlagTestCase(TestCase):
+    def setUp(self):
+        self.ts = HTimeseries(
+            StringIO(tenmin_test_timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2")
+        )
+        self.result = aggregate(self.ts, "1H", "sum", min_count=3, missing_flag="")
+
+    def test_value(self):
+        self.assertAlmostEqual(self.result.data.loc["2008-02-07 10:00"].value, 31.25)
+
+    def test_flags(self):
+        self.assertEqual(list(self.result.data["flags"]), ["", "", "", ""])
+
+
+class FixedStepsTestCase(TestCase):
+    def setUp(self):
+        self.ts = HTimeseries(
+            StringIO(tenmin_test_timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2")
+        )
+
+    def test_same_as_resample(self):
+        # The values of each interval are summed exactly as pd.Series.sum sums them
+        # in the time series reindexed to whole intervals (as haggregate did when it
+        # used pandas for the aggregation).
+        index = pd.date_range(
+            "2008-02-07 09:40", "2008-02-17 13:10", freq="10min", tz="Etc/GMT-2"
+        )
+        values = np.random.default_rng(42).normal(10, 3, len(index))
+        values[::7] = np.nan
+        ts = HTimeseries(pd.DataFrame({"value": values, "flags": ""}, index=index))
+        for target_step in ("20min", "30min", "1H", "3H", "6H", "1D"):
+            first = (index[0] - pd.Timedelta("1s")).floor(target_step)
+            end = index[-1].ceil(target_step)
+            expected = (
+                ts.data["value"]
+                .reindex(pd.date_range(first, end, freq="10min"))
+                .resample(target_step, closed="right", label="right")
+            )
+            for method in ("sum", "mean"):
+                with self.subTest(target_step=target_step, method=method):
+                    result = aggregate(ts, target_step, method, min_count=1).data
+                    expected_values = expected.agg(getattr(pd.Series, method))
+                    self.assertEqual(
+                        list(result["value"]),
+                        list(expected_values.loc[result.index]),
+                    )
+                    max_count = pd.Timedelta(target_step) // pd.Timedelta("10min")
+                    self.assertEqual(
+                        list(result["flags"]),
+                        [
+                            "MISS" if c < max_count else ""
+                            for c in expected.count().loc[result.index]
+                        ],
+                    )
+
+    def test_target_step_not_multiple_of_source_step(self):
+        msg = "The target step must be a multiple of the source step"
+        with self.assertRaisesRegex(AggregateError, msg):
+            aggregate(self.ts, "25min", "sum")
+
+
+class MonthlySumTestCase(TestCase):
+    def setUp(self):
+        ts = HTimeseries()
+        ts.data = pd.DataFrame(
+            {"value": 1.0, "flags": ""},
+            index=pd.date_range("2008-01-01", "2008-03-01", freq="D", tz="Etc/GMT-2"),
+        )
+        self.result = aggregate(ts, "1M", "sum", min_count=1, missing_flag="MISS")
+
+    def test_index(self):
+        self.assertEqual(
+            list(self.result.data.index),
+            list(pd.date_range("2008-01-01", periods=3, freq="MS", tz="Etc/GMT-2")),
+        )
+
+    def test_values(self):
+        self.assertEqual(list(self.result.data["value"]), [1, 31, 29])
+
+    def test_flags(self):
+        self.assertEqual(list(self.result.data["flags"]), ["MISS", "", ""])
+
+
 class HourlyMeanTestCase(TestCase):
     def setUp(self):
         self.ts = HTimeseries(
@@ -358,3 +505,382 @@ class SetsMetadataTestCase(TestCase):
 
     def test_sets_timezone(self):
         self.assertEqual(self.result.timezone, "EET (+0200)")
+
+    def test_index_name(self):
+        self.assertEqual(self.result.data.index.name, "date")
+
+    def test_index_name_when_source_index_has_no_name(self):
+        self.ts.data.index.name = None
+        result = aggregate(self.ts, "1H", "sum", min_count=3)
+        self.assertEqual(result.data.index.name, "date")
+
+
+class RemoveLeadingAndTrailingNansTestCase(TestCase):
+    def _remove(self, values):
+        ts = AggregatedTimeseries()
+        ts.data = pd.DataFrame(
+            {"value": values, "flags": ""},
+            index=pd.date_range("2008-02-07", periods=len(values), freq="D", tz="UTC"),
+        )
+        ts.remove_leading_and_trailing_nans()
+        return ts.data
+
+    def test_remove(self):
+        data = self._remove([np.nan, np.nan, 1.0, np.nan, 2.0, np.nan])
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data.index[0], pd.Timestamp("2008-02-09", tz="UTC"))
+        self.assertEqual(data.index[-1], pd.Timestamp("2008-02-11", tz="UTC"))
+
+    def test_all_null(self):
+        self.assertEqual(len(self._remove([np.nan, np.nan])), 0)
+
+
+class AggregateIterTestCase(TestCase):
+    def _get_chunks(self, ts, size):
+        for i in range(0, len(ts.data), size):
+            chunk = copy.copy(ts)
+            end = i + size
+            chunk.data = ts.data.iloc[i:end]
+            yield chunk
+
+    def _check(self, timeseries, method, **kwargs):
+        ts = HTimeseries(StringIO(timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2"))
+        expected = aggregate(ts, "1H", method, **kwargs).data
+        for size in (1, 2, 3, 5, 6, 7, 100):
+            with self.subTest(method=method, size=size):
+                results = aggregate_iter(
+                    self._get_chunks(ts, size), "1H", method, **kwargs
+                )
+                data = pd.concat([result.data for result in results])
+                pd.testing.assert_frame_equal(data, expected, check_freq=False)
+
+    def test_methods(self):
+        for method in ("sum", "mean", "max", "min"):
+            self._check(tenmin_test_timeseries, method, min_count=3)
+
+    def test_offset(self):
+        self._check(
+            tenmin_test_timeseries, "mean", min_count=3, target_timestamp_offset="1min"
+        )
+
+    def test_leading_and_trailing_nulls(self):
+        self._check(tenmin_test_timeseries, "sum", min_count=6)
+        self._check(tenmin_allmiss_test_timeseries, "sum", min_count=1)
+
+    def test_yields_closed_intervals_before_reading_all_chunks(self):
+        ts = HTimeseries(
+            StringIO(tenmin_test_timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2")
+        )
+        consumed = []
+
+        def chunks():
+            for chunk in self._get_chunks(ts, 4):
+                consumed.append(chunk)
+                yield chunk
+
+        result = next(aggregate_iter(chunks(), "1H", "sum", min_count=3))
+        self.assertEqual(len(consumed), 1)
+        self.assertEqual(
+            result.data.index[-1], pd.Timestamp("2008-02-07 10:00", tz="Etc/GMT-2")
+        )
+
+    def test_irregular_between_chunks(self):
+        ts = HTimeseries(
+            StringIO(tenmin_test_timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2")
+        )
+        ts.data = ts.data.drop(pd.Timestamp("2008-02-07 10:40", tz="Etc/GMT-2"))
+        with self.assertRaises(AggregateError):
+            list(aggregate_iter(self._get_chunks(ts, 6), "1H", "sum"))
+
+
+class AggregateArraysTestCase(TestCase):
+    def setUp(self):
+        self.ts = HTimeseries(
+            StringIO(tenmin_test_timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2")
+        )
+
+    def _aggregate_arrays(self, data, **kwargs):
+        return aggregate_arrays(
+            data.index.asi8,
+            data["value"].to_numpy(),
+            "10min",
+            "1H",
+            "sum",
+            tz=ZoneInfo("Etc/GMT-2"),
+            **kwargs,
+        )
+
+    def test_same_as_aggregate(self):
+        expected = aggregate(self.ts, "1H", "sum", min_count=3).data
+        index, values, counts, missing = self._aggregate_arrays(
+            self.ts.data, min_count=3
+        )
+        # aggregate() also removes the trailing NaN
+        np.testing.assert_array_equal(index[:-1], expected.index.asi8)
+        np.testing.assert_array_equal(values[:-1], expected["value"].to_numpy())
+        self.assertTrue(np.isnan(values[-1]))
+        np.testing.assert_array_equal(counts, [3, 6, 6, 6, 1])
+        np.testing.assert_array_equal(missing, [True, False, False, False, True])
+
+    def test_missing_records(self):
+        data = self.ts.data.drop(pd.Timestamp("2008-02-07 10:40", tz="Etc/GMT-2"))
+        index, values, counts, missing = self._aggregate_arrays(data)
+        np.testing.assert_array_equal(counts, [3, 5, 6, 6, 1])
+        np.testing.assert_array_equal(missing, [True, True, False, False, True])
+
+    def test_empty(self):
+        index, values, counts, missing = self._aggregate_arrays(self.ts.data.iloc[:0])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.dtype, np.int64)
+        self.assertEqual(len(missing), 0)
+
+    def test_target_step_not_multiple(self):
+        with self.assertRaisesRegex(AggregateError, "multiple of the source step"):
+            aggregate_arrays(np.array([0]), np.array([1.0]), "7min", "1H", "sum")
+
+
+class AggregateFrameTestCase(TestCase):
+    def setUp(self):
+        ts = HTimeseries(
+            StringIO(tenmin_test_timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2")
+        )
+        values = ts.data["value"]
+        self.data = pd.DataFrame(
+            {"a": values, "b": values.where(values > 11), "c": np.nan}
+        )
+
+    def test_same_as_aggregate(self):
+        for method in ("sum", "mean", "max", "min"):
+            values, flags = aggregate_frame(
+                self.data, "1H", method, min_count=3, target_timestamp_offset="1min"
+            )
+            self.assertEqual(list(values.columns), ["a", "b", "c"])
+            self.assertTrue(values["c"].isna().all())
+            for column in ("a", "b"):
+                with self.subTest(method=method, column=column):
+                    ts = HTimeseries(
+                        self.data[[column]]
+                        .rename(columns={column: "value"})
+                        .assign(flags="")
+                    )
+                    expected = aggregate(
+                        ts, "1H", method, min_count=3, target_timestamp_offset="1min"
+                    ).data
+                    pd.testing.assert_series_equal(
+                        values[column].loc[expected.index],
+                        expected["value"],
+                        check_names=False,
+                        check_freq=False,
+                    )
+                    self.assertEqual(
+                        list(flags[column].loc[expected.index]),
+                        list(expected["flags"]),
+                    )
+
+
+class ExtraMethodsTestCase(TestCase):
+    def setUp(self):
+        self.ts = HTimeseries(
+            StringIO(tenmin_test_timeseries), default_tzinfo=ZoneInfo("Etc/GMT-2")
+        )
+        self.result = aggregate(
+            self.ts,
+            "1H",
+            "mean",
+            min_count=3,
+            extra_methods=["std", "median", "p90", "first", "last", "time_of_max"],
+        )
+        self.record = self.result.data.loc["2008-02-07 13:00"]
+
+    def test_columns(self):
+        self.assertEqual(
+            list(self.result.data.columns),
+            ["value", "flags", "std", "median", "p90", "first", "last", "time_of_max"],
+        )
+
+    def test_same_value_as_without_extra_methods(self):
+        expected = aggregate(self.ts, "1H", "mean", min_count=3).data
+        pd.testing.assert_frame_equal(
+            self.result.data[["value", "flags"]], expected, check_freq=False
+        )
+
+    def test_std_and_percentile(self):
+        values = self.ts.data.loc["2008-02-07 12:10":"2008-02-07 13:00", "value"]
+        self.assertAlmostEqual(self.record["std"], values.std())
+        self.assertAlmostEqual(self.record["p90"], values.quantile(0.9))
+
+    def test_median(self):
+        self.assertAlmostEqual(self.record["median"], 12.16)
+
+    def test_first_and_last(self):
+        self.assertAlmostEqual(self.record["first"], 11.91)
+        self.assertAlmostEqual(self.record["last"], 12.17)
+
+    def test_time_of_max(self):
+        self.assertEqual(
+            self.record["time_of_max"],
+            pd.Timestamp("2008-02-07 12:40", tz="Etc/GMT-2"),
+        )
+
+    def test_time_of_max_is_only_extra(self):
+        with self.assertRaisesRegex(AggregateError, "can only be one of the extra"):
+            aggregate(self.ts, "1H", "time_of_max")
+
+    def test_unknown_method(self):
+        with self.assertRaisesRegex(AggregateError, 'Unknown aggregation method "p"'):
+            aggregate(self.ts, "1H", "sum", extra_methods=["p"])
+
+
+class VectorMeanTestCase(TestCase):
+    def test_vector_mean(self):
+        index, values, counts, missing = aggregate_arrays(
+            pd.date_range("2008-02-07 10:10", periods=6, freq="10min").asi8,
+            np.array([350.0, 10.0, np.nan, 90.0, 180.0, np.nan]),
+            "10min",
+            "30min",
+            "vector_mean",
+        )
+        np.testing.assert_allclose(values, [0.0, 135.0])
+
+
+class AggregationPlanTestCase(TestCase):
+    def _get_plan(self, first, last, tz=None):
+        first, last = pd.DatetimeIndex([first, last]).asi8
+        return _get_plan(first, last, pd.Timedelta("10min"), "1H", tz)
+
+    def test_edges(self):
+        plan = self._get_plan("2008-02-07 09:40", "2008-02-07 11:00")
+        self.assertEqual(
+            list(pd.to_datetime(plan.edges)),
+            list(pd.date_range("2008-02-07 09:00", "2008-02-07 11:00", freq="1H")),
+        )
+        self.assertEqual(list(plan.max_counts), [6, 6])
+
+    def test_shared_by_time_series_with_the_same_bins(self):
+        plan1 = self._get_plan("2008-02-07 09:40", "2008-02-07 11:00")
+        plan2 = self._get_plan("2008-02-07 09:10", "2008-02-07 10:50")
+        self.assertIs(plan1, plan2)
+
+    def test_shared_by_equal_fixed_offsets(self):
+        tz = dt.timezone(dt.timedelta(hours=2))
+        plan1 = self._get_plan("2008-02-07 09:40", "2008-02-07 11:00", tz)
+        plan2 = self._get_plan(
+            "2008-02-07 09:40", "2008-02-07 11:00", TzinfoFromString("+0200")
+        )
+        self.assertIsNot(plan1, self._get_plan("2008-02-07 09:40", "2008-02-07 11:00"))
+        self.assertIs(plan1, plan2)
+
+    def test_records_after_the_last_edge(self):
+        plan = self._get_plan("2008-02-07 09:40", "2008-02-07 11:00")
+        index_ns = pd.date_range("2008-02-07 09:40", "2008-02-07 11:20", freq="10min")
+        with patch("haggregate.haggregate._get_plan", return_value=plan):
+            with self.assertRaisesRegex(AggregateError, "before the last record"):
+                aggregate_arrays(index_ns.asi8, np.ones(11), "10min", "1H", "sum")
+
+    def test_read_only(self):
+        plan = self._get_plan("2008-02-07 09:40", "2008-02-07 11:00")
+        with self.assertRaises(ValueError):
+            plan.edges[0] = 0
+
+
+class TargetTimezoneTestCase(TestCase):
+    def setUp(self):
+        index = pd.date_range(
+            "2008-02-07 00:10", periods=3 * 144, freq="10min", tz="Etc/GMT-2"
+        )
+        self.ts = HTimeseries(
+            pd.DataFrame(
+                {"value": np.arange(len(index), dtype=float)}, index=index
+            ).assign(flags="")
+        )
+
+    def _aggregate_converted(self, tz, **kwargs):
+        ts = copy.copy(self.ts)
+        ts.data = ts.data.tz_convert(tz)
+        return aggregate(ts, "1D", "sum", **kwargs).data
+
+    def _assert_same(self, data, expected):
+        self.assertEqual(list(data.index.asi8), list(expected.index.asi8))
+        self.assertEqual(
+            data.index.tz.utcoffset(None), expected.index.tz.utcoffset(None)
+        )
+        np.testing.assert_array_equal(data["value"], expected["value"])
+        self.assertEqual(list(data["flags"]), list(expected["flags"]))
+
+    def test_labels_at_midnight_of_target_timezone(self):
+        result = aggregate(self.ts, "1D", "sum", target_timezone="+0000")
+        self.assertEqual(result.timezone, "+0000")
+        self.assertEqual(
+            list(result.data.index.strftime("%Y-%m-%d %H:%M%z")),
+            [
+                "2008-02-07 00:00+0000",
+                "2008-02-08 00:00+0000",
+                "2008-02-09 00:00+0000",
+                "2008-02-10 00:00+0000",
+            ],
+        )
+
+    def test_same_as_converted_source(self):
+        result = aggregate(self.ts, "1D", "sum", min_count=144, target_timezone="-0300")
+        expected = self._aggregate_converted(TzinfoFromString("-0300"), min_count=144)
+        self._assert_same(result.data, expected)
+
+    def test_tzinfo(self):
+        tz = ZoneInfo("Etc/GMT-5")
+        result = aggregate(self.ts, "1D", "mean", target_timezone=tz)
+        ts = copy.copy(self.ts)
+        ts.data = ts.data.tz_convert(tz)
+        self._assert_same(result.data, aggregate(ts, "1D", "mean").data)
+
+    def test_source_is_not_converted(self):
+        index = self.ts.data.index
+        aggregate(self.ts, "1D", "sum", target_timezone="+0000")
+        self.assertIs(self.ts.data.index, index)
+
+    def test_aggregate_iter(self):
+        expected = aggregate(self.ts, "1D", "sum", target_timezone="+0000").data
+        chunks = []
+        for i in range(0, len(self.ts.data), 100):
+            chunk = copy.copy(self.ts)
+            end = i + 100
+            chunk.data = self.ts.data.iloc[i:end]
+            chunks.append(chunk)
+        results = aggregate_iter(chunks, "1D", "sum", target_timezone="+0000")
+        data = pd.concat([result.data for result in results])
+        self._assert_same(data, expected)
+
+    def test_aggregate_frame(self):
+        values, flags = aggregate_frame(
+            self.ts.data[["value"]], "1D", "sum", target_timezone="+0000"
+        )
+        expected = self._aggregate_converted(TzinfoFromString("+0000"))
+        self._assert_same(values.assign(flags=flags["value"]), expected)
+
+    def test_fixed_step_across_dst_change(self):
+        index = pd.date_range(
+            "2008-03-29 00:10", "2008-04-01 00:00", freq="10min", tz="UTC"
+        )
+        data = pd.DataFrame({"value": np.ones(len(index))}, index=index)
+        self.ts.data = data.assign(flags="")
+        result = aggregate(
+            self.ts, "3H", "sum", target_timezone=ZoneInfo("Europe/Athens")
+        )
+        self.assertEqual(result.data["value"].sum(), len(index))
+        self.assertGreaterEqual(result.data.index[-1], index[-1])
+        self.assertTrue((np.diff(result.data.index.asi8) == 3 * 3600 * 10**9).all())
+
+    def test_days_across_dst_change(self):
+        index = pd.date_range(
+            "2008-03-28 00:10", "2008-04-02 22:00", freq="10min", tz="UTC"
+        )
+        data = pd.DataFrame({"value": np.ones(len(index))}, index=index)
+        self.ts.data = data.assign(flags="")
+        result = aggregate(
+            self.ts, "1D", "sum", target_timezone=ZoneInfo("Europe/Athens")
+        )
+        self.assertEqual(result.data["value"].sum(), len(index))
+        self.assertTrue((result.data.index.hour == 0).all())
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(AggregateError, "Europe/Athens"):
+            aggregate(self.ts, "1D", "sum", target_timezone="Europe/Athens")
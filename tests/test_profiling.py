@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, skipUnless
+
+from haggregate import profiling
+
+
+class ProfileTestCase(TestCase):
+    def setUp(self):
+        with profiling.profile("mytimeseries") as self.profile:
+            with profiling.stage("read") as stage:
+                stage.result = [1, 2, 3]
+            with profiling.stage("write"):
+                pass
+
+    def test_stages(self):
+        self.assertEqual([s.name for s in self.profile.stages], ["read", "write"])
+
+    def test_records(self):
+        self.assertEqual([s.records for s in self.profile.stages], [3, None])
+
+    def test_time(self):
+        self.assertGreaterEqual(self.profile.time, self.profile.stages[0].time)
+
+    def test_format(self):
+        self.assertRegex(
+            self.profile.format(),
+            r"^mytimeseries: [\d.]+ s \(read [\d.]+ s, 3 records; write [\d.]+ s\); "
+            r"peak RSS ",
+        )
+
+    def test_write(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        filename = os.path.join(tempdir, "stats.jsonl")
+        self.profile.write(filename)
+        self.profile.write(filename)
+        with open(filename) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["name"], "mytimeseries")
+        self.assertEqual(lines[0]["stages"][0]["records"], 3)
+
+
+@skipUnless(profiling.reset_peak_rss(), "The peak RSS can't be reset")
+class PeakRssTestCase(TestCase):
+    def test_peak_of_each_profile(self):
+        with profiling.profile("large") as large:
+            data = b"x" * 200 * 10**6
+            del data
+        with profiling.profile("small") as small:
+            pass
+        self.assertEqual(small.peak_rss_scope, "profile")
+        self.assertLess(small.peak_rss, large.peak_rss - 100 * 10**6)
+
+
+class StageWithoutProfileTestCase(TestCase):
+    def test_not_recorded(self):
+        with profiling.stage("read") as stage:
+            stage.result = [1, 2, 3]
+        self.assertIsNone(stage.time)
+        self.assertIsNone(stage.records)
+
+
+class ProfileInOtherThreadTestCase(TestCase):
+    def test_not_recorded(self):
+        def read():
+            with profiling.stage("read"):
+                pass
+
+        with profiling.profile("mytimeseries") as profile:
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+        self.assertEqual(profile.stages, [])
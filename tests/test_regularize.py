@@ -1,8 +1,10 @@
 import datetime as dt
 import math
+import sys
 import textwrap
 from io import StringIO
-from unittest import TestCase
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
 
 try:
     from zoneinfo import ZoneInfo
@@ -10,9 +12,16 @@ except ImportError:
     from backports.zoneinfo import ZoneInfo
 
 import numpy as np
+import pandas as pd
 from htimeseries import HTimeseries
 
-from haggregate import RegularizationMode, RegularizeError, regularize
+from haggregate import (
+    RegularizationMode,
+    RegularizeError,
+    regularize,
+    regularize_arrays,
+    regularize_frame,
+)
 
 
 class BadTimeStepTestCase(TestCase):
@@ -62,6 +71,15 @@ class RegularizeTestCase(TestCase):
     def test_timestamps_are_aware(self):
         self.assertEqual(self.result.data.index[0].utcoffset(), dt.timedelta(hours=2))
 
+    def test_value_dtype(self):
+        self.assertEqual(self.result.data["value"].dtype, np.float64)
+
+    def test_flags_are_categorical(self):
+        self.assertEqual(
+            sorted(self.result.data["flags"].cat.categories),
+            ["", "FLAG1", "FLAG2 DATEINSERT"],
+        )
+
     def test_value_1(self):
         self.assertAlmostEqual(
             self.result.data.loc["2008-02-07 10:30:00+0200"].value, 10.71
@@ -156,6 +174,40 @@ class RegularizeLastRecordTestCase(TestCase):
         )
 
 
+class RegularizeFirstRecordAtHalfStepTestCase(TestCase):
+    def setUp(self):
+        # The first record is rounded down to 10:20, but it falls outside the
+        # [10:15, 10:25) window, so the first resulting record is null.
+        input = textwrap.dedent(
+            """\
+            2008-02-07 10:25,10.71,
+            2008-02-07 10:30,10.93,
+            2008-02-07 10:40,11.10,
+            """
+        )
+        ts = HTimeseries(StringIO(input), default_tzinfo=ZoneInfo("Etc/GMT-2"))
+        ts.time_step = "10min"
+        self.result = regularize(ts, mode=RegularizationMode.INTERVAL)
+
+    def test_length(self):
+        self.assertEqual(len(self.result.data), 3)
+
+    def test_value_1(self):
+        self.assertTrue(
+            np.isnan(self.result.data.loc["2008-02-07 10:20:00+0200"].value)
+        )
+
+    def test_value_2(self):
+        self.assertAlmostEqual(
+            self.result.data.loc["2008-02-07 10:30:00+0200"].value, 10.93
+        )
+
+    def test_value_3(self):
+        self.assertAlmostEqual(
+            self.result.data.loc["2008-02-07 10:40:00+0200"].value, 11.10
+        )
+
+
 class RegularizeNullRecordTestCase(TestCase):
     def setUp(self):
         input = textwrap.dedent(
@@ -282,3 +334,191 @@ class SetsMetadataTestCase(TestCase):
 
     def test_sets_timezone(self):
         self.assertEqual(self.result.timezone, "EET (+0200)")
+
+
+regularize_module = sys.modules["haggregate.regularize"]
+
+
+class BackendTestCase(TestCase):
+    def setUp(self):
+        input = textwrap.dedent(
+            """\
+            2008-02-07 10:30,10.71,FLAG1
+            2008-02-07 10:41,10.93,FLAG2
+            2008-02-07 10:50,11.10,
+            """
+        )
+        self.ts = HTimeseries(StringIO(input), default_tzinfo=ZoneInfo("Etc/GMT-2"))
+        self.ts.time_step = "10min"
+
+    def test_numpy(self):
+        result = regularize(self.ts, mode=RegularizationMode.INTERVAL, backend="numpy")
+        self.assertAlmostEqual(result.data.loc["2008-02-07 10:40"].value, 10.93)
+        self.assertEqual(
+            result.data.loc["2008-02-07 10:40"]["flags"], "FLAG2 DATEINSERT"
+        )
+
+    def test_unknown(self):
+        msg = 'Unknown regularization backend "hello"'
+        with self.assertRaisesRegex(RegularizeError, msg):
+            regularize(self.ts, mode=RegularizationMode.INTERVAL, backend="hello")
+
+    @patch.object(regularize_module, "_perform_regularization_cython", None)
+    def test_cython_unavailable(self):
+        msg = "The cython backend is not available"
+        with self.assertRaisesRegex(RegularizeError, msg):
+            regularize(self.ts, mode=RegularizationMode.INTERVAL, backend="cython")
+
+    @patch.object(regularize_module, "_perform_regularization_cython", None)
+    def test_default_when_cython_unavailable(self):
+        result = regularize(self.ts, mode=RegularizationMode.INTERVAL)
+        self.assertAlmostEqual(result.data.loc["2008-02-07 10:40"].value, 10.93)
+
+
+class DisturbedTimeseriesMixin:
+    """A disturbed time series, checked with _check() in each regularization mode."""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        timestamps = np.unique(
+            np.arange(2000) * 600
+            + rng.choice([-300, -299, -120, 0, 0, 0, 0, 120, 299, 300], 2000)
+        )
+        timestamps = timestamps[rng.random(len(timestamps)) > 0.1]
+        values = rng.normal(size=len(timestamps))
+        values[rng.random(len(timestamps)) < 0.1] = np.nan
+        self.ts = HTimeseries(
+            pd.DataFrame(
+                {
+                    "value": values,
+                    "flags": np.where(rng.random(len(timestamps)) < 0.1, "FLAG", ""),
+                },
+                index=pd.to_datetime(1_200_000_000 + timestamps, unit="s").tz_localize(
+                    dt.timezone.utc
+                ),
+            )
+        )
+        self.ts.time_step = "10min"
+
+    def test_interval(self):
+        self._check(RegularizationMode.INTERVAL)
+
+    def test_instantaneous(self):
+        self._check(RegularizationMode.INSTANTANEOUS)
+
+
+@skipUnless(regularize_module._perform_regularization_cython, "Extension not compiled")
+class BackendsAgreeTestCase(DisturbedTimeseriesMixin, TestCase):
+    """Check that both backends give the same results on a disturbed time series."""
+
+    def _check(self, mode):
+        cython_result = regularize(self.ts, mode=mode, backend="cython")
+        numpy_result = regularize(self.ts, mode=mode, backend="numpy")
+        pd.testing.assert_frame_equal(cython_result.data, numpy_result.data)
+
+
+class RegularizeFrameTestCase(DisturbedTimeseriesMixin, TestCase):
+    """Check that regularizing many columns at once is like doing it one by one."""
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(43)
+        data = self.ts.data
+        self.values = pd.DataFrame(
+            {
+                "a": data["value"],
+                "b": data["value"].where(rng.random(len(data)) > 0.3),
+                "c": np.nan,
+            }
+        )
+        self.flags = pd.DataFrame(
+            {"a": data["flags"], "b": "", "c": np.where(data["flags"], "", "X")},
+            index=data.index,
+        )
+
+    def _check(self, mode):
+        values, flags = regularize_frame(
+            self.values, "10min", flags=self.flags, mode=mode
+        )
+        for column in self.values.columns:
+            with self.subTest(column=column):
+                self.ts.data = pd.DataFrame(
+                    {"value": self.values[column], "flags": self.flags[column]}
+                )
+                expected = regularize(self.ts, mode=mode).data
+                pd.testing.assert_series_equal(
+                    values[column], expected["value"], check_names=False
+                )
+                self.assertEqual(list(flags[column]), list(expected["flags"]))
+
+    def test_without_flags(self):
+        values, flags = regularize_frame(self.values, "10min")
+        self.assertEqual(set(flags["a"]), {"", "DATEINSERT"})
+
+
+class RegularizeArraysTestCase(TestCase):
+    def setUp(self):
+        timestamps = pd.DatetimeIndex(
+            ["2008-02-07 10:30", "2008-02-07 10:41", "2008-02-07 10:50"], tz="UTC"
+        )
+        self.index = timestamps.asi8
+        self.values = np.array([10.71, 10.93, 11.10])
+        self.flags = np.array(["FLAG1", "FLAG2", ""])
+
+    def _regularize(self, flags, **kwargs):
+        return regularize_arrays(
+            self.index,
+            self.values,
+            flags,
+            "10min",
+            mode=RegularizationMode.INTERVAL,
+            **kwargs,
+        )
+
+    def test_result(self):
+        index, values, flags = self._regularize(self.flags)
+        expected = self.index[0] + np.arange(3) * 600 * 10**9
+        self.assertEqual(list(index), list(expected))
+        np.testing.assert_allclose(values, [10.71, 10.93, 11.10])
+        self.assertEqual(list(flags), ["FLAG1", "FLAG2 DATEINSERT", ""])
+
+    def test_without_flags(self):
+        index, values, flags = self._regularize(None)
+        self.assertEqual(list(flags), ["", "DATEINSERT", ""])
+
+    def test_read_only_arrays(self):
+        for array in (self.index, self.values):
+            array.setflags(write=False)
+        backends = ["numpy"]
+        if regularize_module._perform_regularization_cython:
+            backends.append("cython")
+        for backend in backends:
+            with self.subTest(backend=backend):
+                index, values, flags = self._regularize(self.flags, backend=backend)
+                np.testing.assert_allclose(values, [10.71, 10.93, 11.10])
+
+    def test_empty(self):
+        index, values, flags = regularize_arrays(
+            np.empty(0, dtype=np.int64), np.empty(0), None, "10min"
+        )
+        self.assertEqual((len(index), len(values), len(flags)), (0, 0, 0))
+
+    def test_long(self):
+        # The length of the result must not be calculated in floating point
+        index = pd.Timestamp("2008-02-07 10:30", tz="UTC").value + (
+            np.arange(20000) * 600 * 10**9
+        )
+        result_index, values, flags = regularize_arrays(
+            index, np.ones(len(index)), None, "10min"
+        )
+        self.assertEqual(len(result_index), 20000)
+        self.assertEqual(result_index[-1], index[-1])
+
+    def test_rounding_in_time_zone(self):
+        # In +0530, 10:30 UTC is 16:00 local, so hourly rounding differs from UTC
+        index, values, flags = regularize_arrays(
+            self.index[:1], self.values[:1], None, "1H", tz="+05:30"
+        )
+        self.assertEqual(
+            pd.Timestamp(index[0], tz="UTC"), pd.Timestamp("2008-02-07 10:30", tz="UTC")
+        )